@@ -0,0 +1,76 @@
+"""store subscription dates as date
+
+Revision ID: e5dc6f21e6dc
+Revises: a9b6aed3a657
+Create Date: 2026-10-18 21:15:33.604182
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5dc6f21e6dc'
+down_revision: Union[str, Sequence[str], None] = 'a9b6aed3a657'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _string_to_date(table: str, column: str, nullable: bool, index: str | None = None) -> None:
+    # batch_alter_table при смене типа копирует данные через CAST(... AS DATE), а в SQLite
+    # это числовое приведение ('2026-11-01' -> 2026). Поэтому переносим значения в новую
+    # колонку через date(), которая к тому же превращает некорректные строки в NULL
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.add_column(sa.Column(f'{column}_date', sa.Date(), nullable=True))
+    op.execute(f'UPDATE {table} SET {column}_date = date({column})')
+    if not nullable:
+        op.execute(f"UPDATE {table} SET {column}_date = date('now', 'localtime') WHERE {column}_date IS NULL")
+    if index:
+        op.drop_index(index, table_name=table)
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.drop_column(column)
+        batch_op.alter_column(f'{column}_date', new_column_name=column, existing_type=sa.Date(),
+                              nullable=nullable)
+    if index:
+        op.create_index(index, table, [column], unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('paid_until', sa.Date(), nullable=True))
+    # Остаток дней уменьшался раз в сутки, поэтому он равен числу дней от сегодняшней даты
+    op.execute(
+        "UPDATE users SET paid_until = date('now', 'localtime', '+' || subscribe_days_left || ' days') "
+        "WHERE subscribe_days_left > 0"
+    )
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('subscribe_days_left')
+
+    _string_to_date('vpn_configs', 'expired', nullable=True, index='ix_vpn_configs_expired')
+    _string_to_date('tmp_invoices', 'paid_at', nullable=True)
+    _string_to_date('tmp_invoices', 'created_at', nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('tmp_invoices') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.Date(), type_=sa.String(length=12),
+                              existing_nullable=False)
+        batch_op.alter_column('paid_at', existing_type=sa.Date(), type_=sa.String(length=12),
+                              existing_nullable=True)
+    with op.batch_alter_table('vpn_configs') as batch_op:
+        batch_op.alter_column('expired', existing_type=sa.Date(), type_=sa.String(length=12),
+                              existing_nullable=True)
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('subscribe_days_left', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(
+        "UPDATE users SET subscribe_days_left = "
+        "max(0, CAST(julianday(paid_until) - julianday(date('now', 'localtime')) AS INTEGER)) "
+        "WHERE paid_until IS NOT NULL"
+    )
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('paid_until')
@@ -0,0 +1,127 @@
+"""
+Замер времени горячих запросов db/requests.py с индексами и без них.
+
+Создаёт временную SQLite базу на 100 000 пользователей и 500 000 конфигов,
+выполняет запросы до и после создания индексов из миграции 99bb4845579f
+и печатает среднее время одного запроса.
+
+Запуск: python benchmarks/db_indexes.py [--users N] [--configs N]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+SCHEMA = '''
+CREATE TABLE users (
+    uid INTEGER PRIMARY KEY,
+    username VARCHAR(150) NOT NULL,
+    subscribe_days_left INTEGER NOT NULL DEFAULT 0,
+    referrer INTEGER,
+    credits_on_account INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE vpn_configs (
+    id INTEGER PRIMARY KEY,
+    file_id VARCHAR NOT NULL UNIQUE,
+    filename VARCHAR NOT NULL,
+    assigned BOOLEAN NOT NULL,
+    expired VARCHAR(12),
+    device VARCHAR(30),
+    uid INTEGER REFERENCES users (uid),
+    disabled BOOLEAN NOT NULL DEFAULT 0
+);
+CREATE TABLE tmp_invoices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER NOT NULL REFERENCES users (uid),
+    number_of_configs INTEGER NOT NULL DEFAULT 1,
+    created_at VARCHAR(12) NOT NULL
+);
+'''
+
+INDEXES = '''
+CREATE UNIQUE INDEX ix_tmp_invoices_uid ON tmp_invoices (uid);
+CREATE INDEX ix_users_referrer ON users (referrer);
+CREATE INDEX ix_vpn_configs_expired ON vpn_configs (expired);
+CREATE INDEX ix_vpn_configs_uid ON vpn_configs (uid);
+CREATE INDEX ix_vpn_configs_free ON vpn_configs (id) WHERE assigned = 0;
+'''
+
+QUERIES = {
+    'профиль: конфиги пользователя': ('SELECT * FROM vpn_configs WHERE uid = ?', lambda n: (random.randint(1, n),)),
+    'выдача: свободные конфиги': (
+        'SELECT id FROM vpn_configs WHERE assigned = 0 ORDER BY id LIMIT 5', lambda n: ()
+    ),
+    'пул: количество свободных': ('SELECT count(*) FROM vpn_configs WHERE assigned = 0', lambda n: ()),
+    'инвойс пользователя': ('SELECT * FROM tmp_invoices WHERE uid = ?', lambda n: (random.randint(1, n),)),
+    'рефералы пользователя': ('SELECT uid FROM users WHERE referrer = ?', lambda n: (random.randint(1, n),)),
+    'истекающие подписки': (
+        'SELECT id, uid FROM vpn_configs WHERE expired BETWEEN ? AND ?',
+        lambda n: ((date.today() - timedelta(days=1)).isoformat(), (date.today() + timedelta(days=3)).isoformat())
+    ),
+}
+
+
+def fill(conn: sqlite3.Connection, users: int, configs: int):
+    today = date.today()
+    conn.executemany(
+        'INSERT INTO users (uid, username, referrer) VALUES (?, ?, ?)',
+        ((uid, f'user{uid}', random.randint(1, users) if uid % 5 == 0 else None) for uid in range(1, users + 1))
+    )
+    # Около 80% конфигов выдано, срок истечения равномерно в пределах года
+    conn.executemany(
+        'INSERT INTO vpn_configs (id, file_id, filename, assigned, expired, device, uid) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (
+            (i, f'drive{i}', f'vpn_configs/{i}.conf', True,
+             (today + timedelta(days=random.randint(-180, 180))).isoformat(), 'ios', random.randint(1, users))
+            if random.random() < 0.8 else
+            (i, f'drive{i}', f'vpn_configs/{i}.conf', False, None, None, None)
+            for i in range(1, configs + 1)
+        )
+    )
+    conn.executemany(
+        'INSERT INTO tmp_invoices (uid, created_at) VALUES (?, ?)',
+        ((uid, today.isoformat()) for uid in range(1, users + 1, 10))
+    )
+    conn.commit()
+
+
+def measure(conn: sqlite3.Connection, users: int, repeat: int) -> dict[str, float]:
+    result = {}
+    for name, (sql, params) in QUERIES.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params(users)).fetchall()
+        result[name] = (time.perf_counter() - started) / repeat * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--configs', type=int, default=500_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.sqlite3'))
+        conn.executescript(SCHEMA)
+        print(f'Заполнение: {args.users} пользователей, {args.configs} конфигов...')
+        fill(conn, args.users, args.configs)
+
+        before = measure(conn, args.users, args.repeat)
+        conn.executescript(INDEXES)
+        conn.execute('ANALYZE')
+        after = measure(conn, args.users, args.repeat)
+        conn.close()
+
+    print(f'\n{"запрос":<34}{"без индексов, мс":>18}{"с индексами, мс":>18}')
+    for name in QUERIES:
+        print(f'{name:<34}{before[name]:>18.3f}{after[name]:>18.3f}')
+
+
+if __name__ == '__main__':
+    main()
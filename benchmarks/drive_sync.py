@@ -0,0 +1,131 @@
+"""
+Инкрементальная синхронизация конфигов с Google Drive на большой папке.
+
+Вместо Drive API подставляется заглушка: папка из --files .conf файлов, которые
+files().list отдаёт страницами по DRIVE_PAGE_SIZE (по умолчанию три страницы),
+а загрузка файла занимает --latency мс при лимите --rate запросов в секунду.
+Запускает list_vpn_configs и _download_configs из integrations/google_api.py
+на временной БД и проверяет, что:
+
+- list_vpn_configs проходит все страницы выдачи;
+- первая синхронизация загружает все файлы и сдвигает отметку modifiedTime;
+- повторная ничего не загружает, а после добавления файлов загружает только новые;
+- при ошибке записи в БД отметка не сдвигается и файлы загружаются повторно.
+
+Запуск из корня проекта (нужен .env): python benchmarks/drive_sync.py [--files N] [--latency МС]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from db.models import Base, async_session  # noqa: E402
+from integrations import google_api as ggl  # noqa: E402
+from utils import TokenBucket  # noqa: E402
+
+
+class FakeDrive:
+    """Заглушка files().list/get_media: папка с файлами, выдача страницами по modifiedTime."""
+
+    def __init__(self, files: int, latency: float):
+        self.latency = latency
+        self.files: list[dict] = []
+        self.list_calls = 0
+        self.downloads = 0
+        self.add(files)
+
+    def add(self, count: int):
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=len(self.files))
+        for i in range(count):
+            number = len(self.files)
+            self.files.append({
+                'id': f'drive{number}',
+                'name': f'vpn_{number}.conf',
+                'modifiedTime': (start + timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            })
+
+    def list_page(self, folder_id: str, modified_after: str | None, page_token: str | None) -> dict:
+        self.list_calls += 1
+        files = [f for f in self.files if modified_after is None or f['modifiedTime'] >= modified_after]
+        offset = int(page_token or 0)
+        page = files[offset:offset + ggl.DRIVE_PAGE_SIZE]
+        result = {'files': page}
+        if offset + ggl.DRIVE_PAGE_SIZE < len(files):
+            result['nextPageToken'] = str(offset + ggl.DRIVE_PAGE_SIZE)
+        return result
+
+    def download(self, file_id: str, filename: str, dest_folder: str = 'vpn_configs') -> str:
+        time.sleep(self.latency)
+        self.downloads += 1
+        file_path = os.path.join(dest_folder, filename)
+        with open(file_path, 'w') as f:
+            f.write(f'# {file_id}\n')
+        return file_path
+
+
+async def sync(drive: FakeDrive, title: str) -> int:
+    downloads = drive.downloads
+    started = time.perf_counter()
+    await ggl.download_configs()
+    elapsed = time.perf_counter() - started
+    loaded = drive.downloads - downloads
+    watermark = await db.get_sync_value(ggl.DRIVE_WATERMARK_KEY)
+    print(f'{title:<34}{loaded:>10}{elapsed:>10.2f}  {watermark}')
+    return loaded
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=2500)
+    parser.add_argument('--latency', type=float, default=20, help='время загрузки одного файла, мс')
+    parser.add_argument('--rate', type=float, default=500,
+                        help='лимит запросов к заглушке в секунду (в боте - DRIVE_RATE_LIMIT)')
+    args = parser.parse_args()
+
+    drive = FakeDrive(args.files, args.latency / 1000)
+    with tempfile.TemporaryDirectory() as tmp, \
+            mock.patch.object(ggl, '_list_configs_page', drive.list_page), \
+            mock.patch.object(ggl, '_download_file_from_drive', drive.download), \
+            mock.patch.object(ggl, 'BASE_DIR', tmp), \
+            mock.patch.object(ggl, 'drive_limiter', TokenBucket(args.rate)):
+        engine = create_async_engine(f'sqlite+aiosqlite:///{tmp}/drive_sync.sqlite3')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async_session.configure(bind=engine)
+
+        listed = await ggl.list_vpn_configs()
+        pages = drive.list_calls
+        assert len(listed) == args.files, f'list_vpn_configs вернул {len(listed)} из {args.files}'
+        print(f'list_vpn_configs: {len(listed)} файлов за {pages} запросов\n')
+
+        print(f'{"синхронизация":<34}{"загружено":>10}{"сек":>10}  отметка')
+        assert await sync(drive, 'первая') == args.files
+        assert await sync(drive, 'повторная') == 0
+
+        drive.add(10)
+        failure = OperationalError('INSERT', {}, Exception('database is locked'))
+        with mock.patch.object(db, 'update_configs', side_effect=failure):
+            watermark = await db.get_sync_value(ggl.DRIVE_WATERMARK_KEY)
+            try:
+                await sync(drive, '+10 файлов, ошибка БД')
+            except OperationalError:
+                print(f'{"+10 файлов, ошибка БД":<34}{"-":>10}{"-":>10}  {watermark}')
+            assert await db.get_sync_value(ggl.DRIVE_WATERMARK_KEY) == watermark, 'отметка сдвинулась'
+        assert await sync(drive, '+10 файлов, повтор') == 10
+        assert len(await db.get_all_configs()) == args.files + 10
+        await engine.dispose()
+    print('\nOK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
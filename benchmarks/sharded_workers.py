@@ -0,0 +1,161 @@
+"""
+Пропускная способность обработки апдейтов при раздаче по процессам-воркерам (bot/sharding.py).
+
+Супервизор раздаёт синтетические апдейты от --users пользователей воркерам по uid,
+обработчик aiogram в воркере имитирует работу на CPU (--work мс) и проверяет,
+что апдейты каждого пользователя пришли по порядку. Печатает число апдейтов
+в секунду и ускорение относительно одного воркера.
+
+С --db обработчик вместо этого проходит путь выбора устройства из bot/handler.py:
+DbSessionMiddleware, create_user, reg_invoice, get_invoice_by_uid и save_user_cache
+на общей для всех воркеров временной SQLite с профилем PRAGMA из Config. Все воркеры
+пишут в один файл, а запись в SQLite идёт по одной транзакции за раз, поэтому
+в этом режиме потолок задаёт БД и рост с числом воркеров быстро прекращается.
+При тысячах одновременных пользователей (--users) несколько процессов к тому же
+конкурируют за блокировку записи, и часть транзакций не дожидается её за busy_timeout.
+
+Запуск из корня проекта (нужен .env): python benchmarks/sharded_workers.py [--workers 1,2,4,8]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from bot.middlewares import DbSessionMiddleware  # noqa: E402
+from bot.sharding import Supervisor, consume_updates  # noqa: E402
+from config import Config  # noqa: E402
+from db.models import Base, async_session, set_sqlite_pragmas  # noqa: E402
+
+TOKEN = '123456:BENCHMARK'
+
+
+def make_update(update_id: int, uid: int, seq: int) -> dict:
+    user = {'id': uid, 'is_bot': False, 'first_name': 'user'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': str(seq),
+            'chat': {'id': uid, 'type': 'private'}, 'from': user,
+        },
+    }
+
+
+def bind_db(db_path: str):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    set_sqlite_pragmas(engine, Config.SQLITE_PRAGMAS)
+    async_session.configure(bind=engine)
+    return engine
+
+
+async def run_worker(index: int, updates: multiprocessing.Queue, results: multiprocessing.Queue, work: float,
+                     db_path: str | None):
+    dp = Dispatcher()
+    bot = Bot(TOKEN)
+    last_seq: dict[int, int] = {}
+    stats = {'processed': 0, 'out_of_order': 0}
+
+    def check_order(message: Message):
+        seq = int(message.text)
+        if seq <= last_seq.get(message.from_user.id, -1):
+            stats['out_of_order'] += 1
+        last_seq[message.from_user.id] = seq
+
+    if db_path:
+        bind_db(db_path)
+        dp.update.middleware(DbSessionMiddleware())
+
+        @dp.message()
+        async def handler(message: Message, session: AsyncSession):
+            check_order(message)
+            uid = message.from_user.id
+            await db.create_user(uid, f'user{uid}', session=session)
+            await db.reg_invoice(uid, session=session)
+            await db.get_invoice_by_uid(uid, session=session)
+            await db.save_user_cache(uid, 'ios', None, None, session=session)
+            stats['processed'] += 1
+    else:
+        @dp.message()
+        async def handler(message: Message):
+            check_order(message)
+            await asyncio.sleep(0)  # даём выполниться другим пользователям, как при запросах к БД
+            deadline = time.perf_counter() + work
+            while time.perf_counter() < deadline:
+                pass
+            stats['processed'] += 1
+
+    results.put(('ready', index))
+    await consume_updates(updates, lambda update: dp.feed_raw_update(bot, update))
+    results.put(('done', stats['processed'], stats['out_of_order']))
+    await bot.session.close()
+
+
+def worker(index: int, updates: multiprocessing.Queue, results: multiprocessing.Queue, work: float,
+           db_path: str | None):
+    asyncio.run(run_worker(index, updates, results, work, db_path))
+
+
+async def measure(workers: int, args, db_path: str | None) -> tuple[float, int]:
+    results = multiprocessing.get_context('spawn').Queue()
+    supervisor = Supervisor(workers, target=worker, args=(results, args.work / 1000, db_path))
+    supervisor.start()
+    loop = asyncio.get_running_loop()
+    for _ in range(workers):
+        await loop.run_in_executor(None, results.get)
+
+    started = time.perf_counter()
+    seq: dict[int, int] = {}
+    for update_id in range(args.updates):
+        uid = 1000 + update_id * 7919 % args.users
+        seq[uid] = seq.get(uid, -1) + 1
+        supervisor.dispatch(make_update(update_id, uid, seq[uid]))
+    await supervisor.stop(timeout=600)
+    elapsed = time.perf_counter() - started
+
+    processed = out_of_order = 0
+    for _ in range(workers):
+        _, done, violations = await loop.run_in_executor(None, results.get)
+        processed += done
+        out_of_order += violations
+    assert processed == args.updates, f'обработано {processed} из {args.updates}'
+    return args.updates / elapsed, out_of_order
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4,8', help='варианты числа воркеров через запятую')
+    parser.add_argument('--updates', type=int, default=20_000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--work', type=float, default=1, help='время обработки апдейта на CPU, мс')
+    parser.add_argument('--db', action='store_true', help='обработчик с запросами к SQLite вместо работы на CPU')
+    args = parser.parse_args()
+
+    load = 'запросы к SQLite' if args.db else f'обработка {args.work} мс'
+    print(f'{args.updates} апдейтов от {args.users} пользователей, {load}, ядер: {os.cpu_count()}\n')
+    print(f'{"воркеров":<10}{"апдейтов/с":>12}{"ускорение":>12}{"не по порядку":>16}')
+    base = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in map(int, args.workers.split(',')):
+            db_path = None
+            if args.db:
+                db_path = os.path.join(tmp, f'sharded_{workers}.sqlite3')
+                engine = bind_db(db_path)
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+                await engine.dispose()
+            rate, out_of_order = await measure(workers, args, db_path)
+            base = base or rate
+            print(f'{workers:<10}{rate:>12.0f}{rate / base:>12.2f}{out_of_order:>16}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Сравнение пропускной способности SQLite (aiosqlite) с профилем PRAGMA из Config и без него.
+
+Параллельно работают читатели (выборка пользователя по uid), писатели (обновление
+баланса с коммитом) и периодическое массовое обновление всех пользователей, как в
+ежедневной задаче. Печатает число операций в секунду и количество ошибок
+"database is locked".
+
+Запуск из корня проекта (нужен .env): python benchmarks/sqlite_profile.py [--seconds N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from db.models import set_sqlite_pragmas  # noqa: E402
+
+USERS = 20_000
+
+
+async def prepare(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            'CREATE TABLE users (uid INTEGER PRIMARY KEY, credits INTEGER NOT NULL, days INTEGER NOT NULL)'
+        ))
+        await conn.execute(
+            text('INSERT INTO users (uid, credits, days) VALUES (:uid, 0, 30)'),
+            [{'uid': uid} for uid in range(USERS)]
+        )
+
+
+async def run(engine: AsyncEngine, seconds: float, readers: int, writers: int) -> dict[str, float]:
+    stats = {'reads': 0, 'writes': 0, 'bulk': 0, 'locked': 0}
+    deadline = time.monotonic() + seconds
+
+    async def reader():
+        while time.monotonic() < deadline:
+            try:
+                async with engine.connect() as conn:
+                    await conn.execute(text('SELECT * FROM users WHERE uid = :uid'), {'uid': random.randrange(USERS)})
+                stats['reads'] += 1
+            except OperationalError:
+                stats['locked'] += 1
+
+    async def writer():
+        while time.monotonic() < deadline:
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        text('UPDATE users SET credits = credits + 1 WHERE uid = :uid'),
+                        {'uid': random.randrange(USERS)}
+                    )
+                stats['writes'] += 1
+            except OperationalError:
+                stats['locked'] += 1
+
+    async def bulk():
+        while time.monotonic() < deadline:
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(text('UPDATE users SET days = days - 1 WHERE days > 0'))
+                stats['bulk'] += 1
+            except OperationalError:
+                stats['locked'] += 1
+            await asyncio.sleep(0.5)
+
+    await asyncio.gather(*(reader() for _ in range(readers)), *(writer() for _ in range(writers)), bulk())
+    return {key: value / seconds if key != 'locked' else value for key, value in stats.items()}
+
+
+async def measure(pragmas: dict | None, args) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(
+            f'sqlite+aiosqlite:///{os.path.join(tmp, "bench.sqlite3")}',
+            pool_size=Config.SQLITE_POOL_SIZE,
+            max_overflow=Config.SQLITE_POOL_SIZE,
+        )
+        if pragmas:
+            set_sqlite_pragmas(engine, pragmas)
+        await prepare(engine)
+        result = await run(engine, args.seconds, args.readers, args.writers)
+        await engine.dispose()
+        return result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    args = parser.parse_args()
+
+    pragmas = Config.SQLITE_PRAGMAS or None
+    default = await measure(None, args)
+    tuned = await measure(pragmas, args)
+    print(f'Профиль: {pragmas}\n')
+    print(f'{"":<28}{"без профиля":>14}{"с профилем":>14}')
+    for key, title in [('reads', 'чтений/с'), ('writes', 'записей/с'),
+                       ('bulk', 'массовых обновлений/с'), ('locked', 'ошибок locked')]:
+        print(f'{title:<28}{default[key]:>14.1f}{tuned[key]:>14.1f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,182 @@
+"""
+Сравнение задержки доставки апдейтов при long polling и в режиме вебхука.
+
+Поднимает локальный фейковый Telegram: он отдаёт апдейты через getUpdates
+или отправляет их POST-запросом на вебхук бота (create_app из bot/webhook.py)
+с секретным токеном. Каждому ответу фейкового сервера и каждому его запросу
+добавляется задержка --rtt/2, как у сети до серверов Telegram. Апдейты приходят
+с частотой --rate в секунду, обработчик имитирует работу с БД (--work мс).
+Печатает задержку от появления апдейта в Telegram до начала его обработки.
+
+Дополнительно проверяет, что запрос с неверным секретом отклоняется.
+
+Запуск из корня проекта (нужен .env): python benchmarks/webhook_latency.py [--updates N] [--rate N]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.webhook import create_app  # noqa: E402
+
+TOKEN = '123456:BENCHMARK'
+SECRET = 'benchmark-secret'
+TG_PORT = 18081
+BOT_PORT = 18082
+WEBHOOK_PATH = '/webhook'
+
+
+class FakeTelegram:
+    """Минимальный Bot API: getMe и getUpdates (остальные методы возвращают True), отправка апдейтов на вебхук."""
+
+    def __init__(self, rtt: float):
+        self.delay = rtt / 2
+        self.queue: asyncio.Queue[dict] = asyncio.Queue()
+        self.webhook_url: str | None = None
+        self.client: ClientSession | None = None
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        params = await request.post()
+        await asyncio.sleep(self.delay)  # запрос бота идёт до Telegram
+        if method == 'getme':
+            response = self.ok({'id': 123456, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'})
+        elif method == 'getupdates':
+            response = self.ok(await self.get_updates(float(params.get('timeout', 0))))
+        else:
+            response = self.ok(True)
+        await asyncio.sleep(self.delay)  # ответ идёт обратно
+        return response
+
+    async def get_updates(self, timeout: float) -> list[dict]:
+        try:
+            updates = [await asyncio.wait_for(self.queue.get(), timeout or 0.01)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.queue.empty():
+            updates.append(self.queue.get_nowait())
+        return updates
+
+    async def post_webhook(self, update: dict, secret: str = SECRET) -> int:
+        await asyncio.sleep(self.delay)
+        async with self.client.post(self.webhook_url, json=update,
+                                    headers={'X-Telegram-Bot-Api-Secret-Token': secret}) as response:
+            return response.status
+
+    def push(self, update: dict):
+        if self.webhook_url:
+            asyncio.create_task(self.post_webhook(update))
+        else:
+            self.queue.put_nowait(update)
+
+
+def make_update(update_id: int) -> dict:
+    uid = 1000 + update_id % 500
+    user = {'id': uid, 'is_bot': False, 'first_name': 'user'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': str(update_id),
+            'chat': {'id': uid, 'type': 'private'}, 'from': user,
+        },
+    }
+
+
+def make_dispatcher(sent_at: dict[int, float], latencies: list[float], done: asyncio.Event,
+                    total: int, work: float) -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handler(message: Message):
+        latencies.append(time.perf_counter() - sent_at[message.message_id])
+        await asyncio.sleep(work)
+        if len(latencies) == total:
+            done.set()
+
+    return dp
+
+
+async def produce(telegram: FakeTelegram, sent_at: dict[int, float], total: int, rate: float):
+    for update_id in range(1, total + 1):
+        sent_at[update_id] = time.perf_counter()
+        telegram.push(make_update(update_id))
+        await asyncio.sleep(1 / rate)
+
+
+async def measure(mode: str, args) -> list[float]:
+    telegram = FakeTelegram(args.rtt / 1000)
+    telegram.client = ClientSession()
+    tg_runner = web.AppRunner(telegram.app)
+    await tg_runner.setup()
+    await web.TCPSite(tg_runner, '127.0.0.1', TG_PORT).start()
+
+    sent_at: dict[int, float] = {}
+    latencies: list[float] = []
+    done = asyncio.Event()
+    dp = make_dispatcher(sent_at, latencies, done, args.updates, args.work / 1000)
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{TG_PORT}')))
+
+    bot_runner = None
+    if mode == 'webhook':
+        bot_runner = web.AppRunner(create_app(dp, bot, WEBHOOK_PATH, SECRET))
+        await bot_runner.setup()
+        await web.TCPSite(bot_runner, '127.0.0.1', BOT_PORT).start()
+        telegram.webhook_url = f'http://127.0.0.1:{BOT_PORT}{WEBHOOK_PATH}'
+        status = await telegram.post_webhook(make_update(0), secret='wrong')
+        assert status == 401, f'запрос с неверным секретом должен отклоняться, получен {status}'
+        worker = None
+    else:
+        worker = asyncio.create_task(dp.start_polling(bot, polling_timeout=10, handle_signals=False))
+        await asyncio.sleep(0.5)  # бот успевает отправить первый getUpdates
+
+    await produce(telegram, sent_at, args.updates, args.rate)
+    await asyncio.wait_for(done.wait(), 60)
+
+    if worker:
+        await dp.stop_polling()
+        await worker
+    else:
+        await bot_runner.cleanup()
+    await telegram.client.close()
+    await tg_runner.cleanup()
+    return latencies
+
+
+def describe(latencies: list[float]) -> str:
+    ms = sorted(value * 1000 for value in latencies)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    return f'{statistics.mean(ms):>10.1f}{statistics.median(ms):>10.1f}{p95:>10.1f}{ms[-1]:>10.1f}'
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=200, help='апдейтов в секунду')
+    parser.add_argument('--rtt', type=float, default=40, help='задержка сети до Telegram туда-обратно, мс')
+    parser.add_argument('--work', type=float, default=20, help='время обработки апдейта, мс')
+    args = parser.parse_args()
+
+    print(f'{args.updates} апдейтов, {args.rate:.0f}/с, RTT {args.rtt:.0f} мс, обработка {args.work:.0f} мс\n')
+    print(f'{"задержка, мс":<14}{"средняя":>10}{"медиана":>10}{"p95":>10}{"макс":>10}')
+    for mode in ('polling', 'webhook'):
+        print(f'{mode:<14}{describe(await measure(mode, args))}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+import db
+from utils import logger
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'loaded_at')
+
+    def __init__(self, state: str | None, data: dict[str, Any], loaded_at: float):
+        self.state = state
+        self.data = data
+        self.loaded_at = loaded_at
+
+
+class SqliteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в общей SQLite (таблица fsm_states).
+
+    Состояния переживают рестарт и доступны всем процессам бота.
+
+    Если апдейты пользователя всегда обрабатывает один процесс (polling или
+    воркеры bot/sharding.py), чтение идёт из локального кеша: запись из БД
+    перечитывается не чаще, чем раз в cache_ttl секунд. Изменения копятся в памяти
+    и раз в flush_interval секунд (или при batch_size изменённых ключей) пишутся
+    в БД одной транзакцией.
+
+    С shared=True (несколько процессов за балансировщиком) состояние всегда
+    читается из БД, а set_state/set_data возвращаются только после записи.
+    Одновременные изменения разных пользователей всё равно уходят одной
+    транзакцией: пока идёт запись, следующие изменения копятся для неё.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, batch_size: int = 500,
+                 cache_ttl: float = 30, cache_size: int = 10000, shared: bool = False):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache_ttl = 0 if shared else cache_ttl
+        self.cache_size = cache_size
+        self.shared = shared
+        self._cache: OrderedDict[str, _Record] = OrderedDict()
+        # Ключ -> номер изменения. Ключ остаётся здесь, пока это изменение не записано в БД
+        self._dirty: dict[str, int] = {}
+        self._version = 0
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [key.bot_id, key.chat_id, key.user_id]
+        if key.thread_id is not None:
+            parts.append(key.thread_id)
+        parts.append(key.destiny)
+        return ':'.join(map(str, parts))
+
+    def _evict(self):
+        # Несохранённые записи не вытесняются, иначе изменение потеряется
+        while len(self._cache) > self.cache_size:
+            for key in self._cache:
+                if key not in self._dirty:
+                    del self._cache[key]
+                    break
+            else:
+                break
+
+    async def _get(self, key: str) -> _Record:
+        now = time.monotonic()
+        record = self._cache.get(key)
+        if record is not None and (key in self._dirty or now - record.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(key)
+            return record
+        row = await db.get_fsm_record(key)
+        # Пока шёл запрос, запись могла быть изменена локально - она новее
+        if key in self._dirty:
+            return self._cache[key]
+        if row is None:
+            record = _Record(None, {}, now)
+        else:
+            record = _Record(row['state'], json.loads(row['data']), now)
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        self._evict()
+        return record
+
+    async def _changed(self, key: str):
+        self._version += 1
+        self._dirty[key] = self._version
+        if self.shared:
+            await self.flush()
+            return
+        if len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._run())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get(self._key(key))
+        record.state = state.state if isinstance(state, State) else state
+        await self._changed(self._key(key))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._get(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        record = await self._get(self._key(key))
+        record.data = data.copy()
+        await self._changed(self._key(key))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._get(self._key(key))).data.copy()
+
+    async def flush(self):
+        """Сохраняет в БД все накопленные изменения."""
+        async with self._flush_lock:
+            while self._dirty:
+                batch = dict(list(self._dirty.items())[:self.batch_size])
+                updated_at = datetime.now()
+                records, deleted_keys = [], []
+                for key in batch:
+                    record = self._cache[key]
+                    if record.state is None and not record.data:
+                        deleted_keys.append(key)
+                    else:
+                        records.append({
+                            'key': key,
+                            'state': record.state,
+                            'data': json.dumps(record.data, ensure_ascii=False),
+                            'updated_at': updated_at,
+                        })
+                await db.save_fsm_records(records, deleted_keys)
+                now = time.monotonic()
+                for key, version in batch.items():
+                    # Изменённый во время записи ключ остаётся в очереди до следующей
+                    if self._dirty.get(key) == version:
+                        del self._dirty[key]
+                    self._cache[key].loaded_at = now
+            self._evict()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f'Ошибка при сохранении состояний FSM: {e}')
+
+    async def touch(self, keys: list[StorageKey]) -> None:
+        """Переносит время последнего изменения у состояний с недавней активностью."""
+        keys = [self._key(key) for key in keys]
+        updated_at = datetime.now()
+        for i in range(0, len(keys), self.batch_size):
+            await db.touch_fsm_records(keys[i:i + self.batch_size], updated_at)
+
+    async def cleanup(self, ttl: float) -> int:
+        """Удаляет из БД состояния, не менявшиеся дольше ttl секунд."""
+        return await db.delete_fsm_records_before(datetime.now() - timedelta(seconds=ttl))
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
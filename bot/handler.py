@@ -2,31 +2,38 @@ import asyncio
 import json
 import os.path
 import re
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import CommandStart, CommandObject
+from aiogram.filters import CommandStart, CommandObject, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, CallbackQuery, FSInputFile, InputMediaPhoto, LabeledPrice, PreCheckoutQuery, \
-    InputMediaDocument
+from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy.ext.asyncio import AsyncSession
 
-import config
 from config import Config
-from bot import keyboards as kb
-from utils import auto_state_clear, msg_ids, logger, captions
+from bot import keyboards as kb, media, subscriptions, notifications, webhook, sharding
+from bot.fsm_storage import SqliteStorage
+from bot.middlewares import DbSessionMiddleware
+from bot.user_cache import user_cache
+from utils import auto_state_clear, logger, captions, state_expiry
 import db
-from integrations import google_api as ggl
+from integrations import google_api as ggl, vpn_api
 
 scheduler = AsyncIOScheduler()
-dp = Dispatcher()
+fsm_storage = SqliteStorage(
+    flush_interval=Config.FSM_FLUSH_INTERVAL, cache_ttl=Config.FSM_CACHE_TTL, shared=Config.FSM_SHARED
+)
+dp = Dispatcher(storage=fsm_storage)
+if Config.FSM_SHARED:
+    state_expiry.share(fsm_storage)
+dp.update.middleware(DbSessionMiddleware())
 bot = Bot(token=Config.BOT_TOKEN)
-user = {}
+notifier = notifications.Notifier(bot, Config.TG_RATE_LIMIT, Config.TG_CHAT_INTERVAL)
 
 
 class States(StatesGroup):
@@ -49,17 +56,17 @@ async def delete_message_after(message: Message):
 
 
 @dp.message(CommandStart(deep_link=True))
-async def start_with_deeplink(message: Message, command: CommandObject):
+async def start_with_deeplink(message: Message, command: CommandObject, session: AsyncSession):
     uid = message.from_user.id
     try:
-        await db.delete_invoice(uid)
+        await db.delete_invoice(uid, session=session)
     except Exception:
         pass
     username = message.from_user.username if message.from_user.username else message.from_user.full_name
     ref_id = None
     if command.args:
         ref_id = command.args
-        await db.update_user(uid, is_referrer=True)
+        await db.update_user(uid, is_referrer=True, session=session)
     if int(ref_id) == uid:
         await message.answer('<b>Вы не можете быть рефералом'
                              'для самого себя</b>',
@@ -74,33 +81,31 @@ async def start_with_deeplink(message: Message, command: CommandObject):
         pass
     success = await db.create_user(uid,
                                    username,
-                                   ref_id=ref_id)
+                                   ref_id=ref_id,
+                                   session=session)
     if success:
-        await message.answer_photo(FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')),
-                                   reply_markup=kb.start_keyboard)
+        await media.answer_photo(message, reply_markup=kb.start_keyboard, session=session)
     else:
         await message.answer('❌ Вы ранее уже активировали реферальную ссылку')
-        await message.answer_photo(FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')),
-                                   reply_markup=kb.start_keyboard)
+        await media.answer_photo(message, reply_markup=kb.start_keyboard, session=session)
 
 
 @dp.message(CommandStart(deep_link=False))
-async def start(message: Message):
+async def start(message: Message, session: AsyncSession):
     uid = message.from_user.id
     try:
-        await db.delete_invoice(uid)
+        await db.delete_invoice(uid, session=session)
     except Exception as e:
         logger.info(f'{e}')
     username = message.from_user.username if message.from_user.username else message.from_user.full_name
     await db.create_user(uid,
-                         username)
-    await message.answer_photo(FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')),
-                               reply_markup=kb.start_keyboard)
+                         username,
+                         session=session)
+    await media.answer_photo(message, reply_markup=kb.start_keyboard, session=session)
 
 
 async def check_configs(callback: CallbackQuery) -> bool:
-    configs = await db.get_all_configs()
-    if not configs or all(conf["assigned"] for conf in configs):
+    if not await db.config_pool.has_free():
         await callback.answer('⚠️ Ошибка ⚠️')
         await callback.message.answer(
             '⚠️ Сейчас нет доступных конфигураций, попробуйте ещё раз через 10 минут',
@@ -116,57 +121,56 @@ async def check_configs(callback: CallbackQuery) -> bool:
 
 @dp.callback_query()
 @auto_state_clear()
-async def callback_handler(callback: CallbackQuery, state: FSMContext):
+async def callback_handler(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     uid = callback.from_user.id
     data = callback.data
     message = callback.message
     if data == 'main_menu':
         await state.clear()
         try:
-            await db.delete_invoice(uid)
+            await db.delete_invoice(uid, session=session)
         except Exception as e:
             logger.info(f'{e}')
+        cached = user_cache.get(uid)
         try:
-            await bot.delete_messages(uid, list(msg_ids[uid]))
+            await bot.delete_messages(uid, list(cached.msg_ids))
+            cached.msg_ids.clear()
             await message.delete()
         except TelegramBadRequest:
             logger.error(f"Ошибка при удалении сообщений для пользователя {uid}")
         await callback.answer('Главное меню')
-        media = InputMediaPhoto(media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')))
         try:
-            await message.edit_media(media, reply_markup=kb.start_keyboard)
+            await media.edit_photo(message, reply_markup=kb.start_keyboard, session=session)
         except TelegramBadRequest:
-            await message.answer_photo(FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')),
-                                       reply_markup=kb.start_keyboard)
+            await media.answer_photo(message, reply_markup=kb.start_keyboard, session=session)
     # ---------------------------Подключение ВПН-----------------------------
     elif data.startswith('choose_'):
-        await db.reg_invoice(uid)
         device = data.split('_')[1]
+        # Устройство хранится в инвойсе: кеш пользователя к моменту оплаты может быть уже пуст
+        await db.reg_invoice(uid, device=device, session=session)
         logger.info(f'Пользователь выбрал {device}')
         await callback.answer("Количество устройств")
-        if db_user := await db.get_user_data(uid):
+        if db_user := await db.get_user_data(uid, session=session):
             logger.info('Пользователь найден')
             if phone_num := db_user.get('phone_number'):
                 logger.info(f'Номер телефона найден: {phone_num}')
                 if email := db_user.get('email'):
                     logger.info(f'Email найден: {email}')
-                    user[uid] = {
-                        'phone': phone_num,
-                        'email': email,
-                        'device': device
-                    }
+                    cached = user_cache.get(uid)
+                    cached.phone = phone_num
+                    cached.email = email
+                    cached.device = device
+                    await user_cache.save(uid, session)
                     msg = await message.answer('Для скольки устройств вы хотите подключить VPN?\n'
                                             'Введите число от 1 до 100 или выберете вариант на клавиатуре\n\n'
                                             '(цены указаны за 1 устройство)',
                                                reply_markup=kb.nums)
-                    msg_ids[uid].add(msg.message_id)
+                    cached.msg_ids.add(msg.message_id)
                     return
         logger.info('Пользователь не найден')
-        if uid not in user:
-            user[uid] = {}
-        user[uid] = {
-            'device': device
-        }
+        cached = user_cache.get(uid)
+        cached.device = device
+        await user_cache.save(uid, session)
         try:
             msg = await message.edit_caption(
                 caption='Необходимо зарегистрироваться,\n'
@@ -174,7 +178,7 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
                         'Введите номер телефона по форме +79990000000',
                 reply_markup=kb.main_menu
             )
-            msg_ids[uid].add(msg.message_id)
+            cached.msg_ids.add(msg.message_id)
         except TelegramBadRequest:
             msg = await message.edit_text(
                         'Необходимо зарегистрироваться,'
@@ -182,38 +186,32 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
                         'Введите номер телефона по форме +79990000000',
                 reply_markup=kb.main_menu
             )
-            msg_ids[uid].add(msg.message_id)
+            cached.msg_ids.add(msg.message_id)
         await state.set_state(States.phone_number)
-        msg_ids[uid].add(message.message_id)
-        logger.info(f'{user[uid]}')
+        cached.msg_ids.add(message.message_id)
+        logger.info(f'Устройство пользователя {uid}: {cached.device}')
     elif data == 'connect_vpn':
         if not await check_configs(callback):
             return
         await callback.answer("Выберите устройство")
-        media = InputMediaPhoto(
-            media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')),
-            caption='Ваше устройство ⤵️'
-        )
-        msg = await message.edit_media(media, reply_markup=kb.choose_device)
-        msg_ids[uid].add(msg.message_id)
+        msg = await media.edit_photo(message, caption='Ваше устройство ⤵️', reply_markup=kb.choose_device,
+                                     session=session)
+        user_cache.get(uid).msg_ids.add(msg.message_id)
     elif data.startswith('tariff_'):
         await callback.answer("Оплата")
         months = int(data.split('_')[1])
-        user_info = await db.get_user_data(uid)
+        user_info = await db.get_user_data(uid, session=session)
         user_credits = user_info['credits_on_account']
-        media = InputMediaPhoto(media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')),
-                                caption=f'Списать бонусные баллы?\n'
-                                        f'🏦 Баланс: ({user_credits})\n'
-                                        f'Минимальная сумма оплаты бонусами - 100₽')
+        caption = (f'Списать бонусные баллы?\n'
+                   f'🏦 Баланс: ({user_credits})\n'
+                   f'Минимальная сумма оплаты бонусами - 100₽')
         config_id = None
         if data.endswith('cid'):
             config_id = int(data.split('_')[2])
-            conf_info = await db.get_config_by_id(config_id)
-            await db.reg_invoice(uid)
-            device = conf_info['device']
-            user[uid] = {
-                'device': device
-            }
+            conf_info = await db.get_config_by_id(config_id, session=session)
+            await db.reg_invoice(uid, device=conf_info['device'], session=session)
+            user_cache.get(uid).device = conf_info['device']
+            await user_cache.save(uid, session)
         match months:
             case 1:
                 summ = 299
@@ -230,19 +228,20 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
             uid,
             summary=summ,
             days_to_increase=months*30,
-            config_id=config_id
+            config_id=config_id,
+            session=session
         )
         logger.info(f'{invoice}')
-        await message.edit_media(media, reply_markup=kb.use_credits)
+        await media.edit_photo(message, caption=caption, reply_markup=kb.use_credits, session=session)
     elif data in ['use', 'not use']:
         flag = True if data == 'use' else False
         invoice = await db.update_invoice(
             uid,
             use_credits=flag,
+            session=session
         )
         months = int(invoice['days_to_increase']//30)
-        media = InputMediaPhoto(media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')))
-        await message.edit_media(media, reply_markup=kb.payment_options(months))
+        await media.edit_photo(message, reply_markup=kb.payment_options(months), session=session)
     elif data == 'no_ref':
         await state.clear()
         await message.edit_text('Инструкция к подключению',
@@ -250,19 +249,19 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
     # ---------------------------Личный кабинет------------------------------
     elif data == 'account':
         await callback.answer("Личный кабинет")
-        me = await db.get_user_data(uid)
+        me = await db.get_user_data(uid, session=session)
         pay_datetime = me['pay_date_time'] if me['pay_date_time'] else 'Не оплачено'
         credits_on_acc = me['credits_on_account']
         text = (f'📅 Дата последней оплаты:   {pay_datetime}\n\n'
                 f'🏦 Бонусов на счету:   {credits_on_acc}\n\n'
                 f'📱 Ваши устройства:')
 
-        media = InputMediaPhoto(media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')), caption=text)
-        await message.edit_media(media, reply_markup=await kb.account(uid))
+        await media.edit_photo(message, caption=text, reply_markup=await kb.account(uid, session),
+                               session=session)
     # -------------------------Реферальная программа-------------------------
     elif data == 'referral':
         await callback.answer('Реферальная программа')
-        msg_ids[uid].add(message.message_id)
+        user_cache.get(uid).msg_ids.add(message.message_id)
         bot_info = await bot.me()
         ref_code = f'https://t.me/{bot_info.username}?start={uid}'
         await message.answer('🔥 Вам - 25% от каждого пополнения\n'
@@ -276,8 +275,7 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
     # --------------------------------Помощь---------------------------------
     elif data == 'help':
         await callback.answer('Помощь')
-        media = InputMediaPhoto(media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')))
-        await message.edit_media(media, reply_markup=kb.help_kb)
+        await media.edit_photo(message, reply_markup=kb.help_kb, session=session)
     elif data == 'instructions':
         instructions = await ggl.get_instructions()
         headers: list[str] = list(instructions.keys())
@@ -295,12 +293,14 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
                 try:
                     reply_markup = kb.main_menu if i + 1 == len(headers) else None
                     if links[i]:
-                        msg = await bot.send_photo(
-                            chat_id=uid,
-                            photo=links[i],
+                        msg = await media.send_photo(
+                            bot,
+                            uid,
+                            links[i],
                             caption=f'<b>{headers[i].capitalize()}</b>\n\n{texts[i]}',
                             reply_markup=reply_markup,
-                            parse_mode='HTML'
+                            parse_mode='HTML',
+                            session=session
                         )
                     else:
                         msg = await bot.send_message(
@@ -310,7 +310,7 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
                             parse_mode='HTML',
                             disable_web_page_preview=True
                         )
-                    msg_ids[uid].add(msg.message_id)
+                    user_cache.get(uid).msg_ids.add(msg.message_id)
                 except Exception as e:
                     logger.error(f"Ошибка при отправке уведомления {headers[i]} для {uid}: {e}")
         else:
@@ -332,20 +332,21 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
                 summ = 2299
             case _:
                 summ = 299
-        invoice_info = await db.get_invoice_by_uid(uid)
+        invoice_info = await db.get_invoice_by_uid(uid, session=session)
         number_of_configs = int(invoice_info['number_of_configs'])
         logger.info(number_of_configs)
         summ *= number_of_configs
         logger.info(summ)
         use_credits = invoice_info['use_credits']
-        if db_user := await db.get_user_data(uid):
+        cached = await user_cache.load(uid, session)
+        if db_user := await db.get_user_data(uid, session=session):
             logger.info('Пользователь найден')
             if phone_num := db_user.get('phone_number'):
                 logger.info(f'Номер телефона найден: {phone_num}')
                 if email := db_user.get('email'):
                     logger.info(f'Email найден: {email}')
-                    user[uid]['phone'] = phone_num
-                    user[uid]['email'] = email
+                    cached.phone = phone_num
+                    cached.email = email
         credits_on_acc = db_user['credits_on_account']
         if use_credits and credits_on_acc > 0:
             if summ <= credits_on_acc:
@@ -368,8 +369,8 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
             'receipt': {
                 'customer': {
                     'full_name': callback.from_user.full_name,
-                    'phone': user[uid]['phone'],
-                    'email': user[uid]['email']
+                    'phone': cached.phone,
+                    'email': cached.email
                 },
                 'items': [
                     {
@@ -400,45 +401,35 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
                                                 )
         except Exception as e:
             logger.error(f"{e}")
-        msg_ids[uid].add(invoice.message_id)
+        cached.msg_ids.add(invoice.message_id)
         back_msg = await message.answer('Вернуться в главное меню',
                                         reply_markup=kb.main_menu)
-        msg_ids[uid].add(back_msg.message_id)
+        cached.msg_ids.add(back_msg.message_id)
     elif data == 'add_device':
         if not await check_configs(callback):
             return
-        media = InputMediaPhoto(
-            media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')),
-            caption='Ваше устройство ⤵️'
-        )
-        msg = await message.edit_media(media, reply_markup=kb.choose_device)
-        msg_ids[uid].add(msg.message_id)
+        msg = await media.edit_photo(message, caption='Ваше устройство ⤵️', reply_markup=kb.choose_device,
+                                     session=session)
+        user_cache.get(uid).msg_ids.add(msg.message_id)
     elif data in ['ios', 'android', 'windows', 'mac']:
-        media = InputMediaPhoto(media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')))
-        await message.edit_media(media, reply_markup=kb.connect_vpn())
+        await media.edit_photo(message, reply_markup=kb.connect_vpn(), session=session)
     elif data.startswith('device_'):
         config_id = data.split('_')[1]
-        config_info = await db.get_config_by_id(config_id)
+        config_info = await db.get_config_by_id(config_id, session=session)
         conf_path = config_info['filename']
         device: str = config_info['device']
-        exp_date = config_info['expired']  # строка вида 'YYYY-MM-DD'
-        now = datetime.now().strftime('%Y-%m-%d')
-
-        # Преобразуем строки в объекты datetime
-        exp_dt = datetime.strptime(exp_date, '%Y-%m-%d')
-        now_dt = datetime.strptime(now, '%Y-%m-%d')
-
-        # Вычисляем разницу в днях
-        days_left = (exp_dt - now_dt).days
+        days_left = (config_info['expired'] - date.today()).days
         await message.delete()
 
         try:
             # Отправляем файл с конфигурацией
-            await callback.message.answer_document(
-                document=FSInputFile(conf_path),
+            await media.answer_config(
+                callback.message,
+                config_info,
                 caption=f"📲 Тип устройства - {device}\n"
                         f"⏳ Истекает через {days_left} дней",
-                reply_markup=kb.back_to_acc(int(config_id))
+                reply_markup=kb.back_to_acc(int(config_id)),
+                session=session
             )
             await callback.answer("Конфигурация отправлена")
 
@@ -455,41 +446,32 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
     elif data.startswith('renew_'):
         config_id = data.split('_')[1]
         await callback.answer("Продлить подписку")
-        media = InputMediaPhoto(media=FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png')))
-        await message.edit_media(media, reply_markup=kb.connect_vpn(int(config_id)))
+        await media.edit_photo(message, reply_markup=kb.connect_vpn(int(config_id)), session=session)
     elif data.endswith('_instructions'):
         await callback.answer('Инструкция к подключению')
         device = data.split('_')[0]
-        instructions = await ggl.get_instructions()
-        headers: list[str] = list(instructions.keys())
-        texts: list[str] = []
-        links = []
-        if instructions:
-            for header in headers:
-                _text, _link = instructions[header]
-                text: str = _text
-                link: str = _link
-                texts.append(text)
-                links.append(link)
-            for i in range(len(headers)):
-                if headers[i] == device:
-                    logger.info(f'Header: {headers[i]}, device: {device}')
-                    if links[i] is not None:
-                        await bot.send_photo(
-                            chat_id=uid,
-                            photo=links[i],
-                            caption=f'<b>{headers[i].capitalize()}</b>\n\n{texts[i]}',
-                            reply_markup=kb.close_instruction,
-                            parse_mode='HTML'
-                        )
-                    else:
-                        await bot.send_message(
-                            chat_id=uid,
-                            text=f'<b>{headers[i].capitalize()}</b>\n\n{texts[i]}',
-                            reply_markup=kb.close_instruction,
-                            parse_mode='HTML',
-                            disable_web_page_preview=True
-                            )
+        instruction = await ggl.get_device_instruction(device)
+        if instruction:
+            text, link = instruction
+            logger.info(f'Отправка инструкции для {device}')
+            if link is not None:
+                await media.send_photo(
+                    bot,
+                    uid,
+                    link,
+                    caption=f'<b>{device.capitalize()}</b>\n\n{text}',
+                    reply_markup=kb.close_instruction,
+                    parse_mode='HTML',
+                    session=session
+                )
+            else:
+                await bot.send_message(
+                    chat_id=uid,
+                    text=f'<b>{device.capitalize()}</b>\n\n{text}',
+                    reply_markup=kb.close_instruction,
+                    parse_mode='HTML',
+                    disable_web_page_preview=True
+                )
         else:
             await message.edit_caption(caption='К сожалению, инструкция сейчас недоступна...',
                                        reply_markup=kb.main_menu)
@@ -498,22 +480,34 @@ async def callback_handler(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
+@dp.message(Command('stats'))
+async def stats_handler(message: Message):
+    if str(message.from_user.id) != str(Config.ADMIN_ID):
+        return
+    stats = await db.count_configs_by_status()
+    await message.answer(f'📦 Конфигураций всего: {stats["total"]}\n'
+                         f'🟢 Свободных: {stats["free"]}\n'
+                         f'🔵 Активных: {stats["active"]}\n'
+                         f'🟠 Истёкших: {stats["expired"]}\n'
+                         f'🔴 Отключено на сервере: {stats["disabled"]}')
+
+
 @dp.message(F.text.isdigit())
-async def numbers_handler(message: Message):
+async def numbers_handler(message: Message, session: AsyncSession):
     uid = message.from_user.id
-    msg_ids[uid].add(message.message_id)
+    user_cache.get(uid).msg_ids.add(message.message_id)
     number = int(message.text)
     logger.info(number)
     if number > 100 or number < 1:
         msg = await message.answer("❌ Некорректное количество. Попробуйте ещё раз.", reply_markup=kb.nums)
-        msg_ids[uid].add(msg.message_id)
+        user_cache.get(uid).msg_ids.add(msg.message_id)
         return
     invoice = await db.update_invoice(
         uid,
-        number_of_configs=number
+        number_of_configs=number,
+        session=session
     )
-    media = FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png'))
-    await message.answer_photo(media, reply_markup=kb.connect_vpn())
+    await media.answer_photo(message, reply_markup=kb.connect_vpn(), session=session)
 
 
 @dp.message(States.ref)
@@ -526,38 +520,42 @@ async def ref_handler(message: Message, state: FSMContext):
 
 @dp.message(States.phone_number)
 @auto_state_clear()
-async def phone_number_handler(message: Message, state: FSMContext):
+async def phone_number_handler(message: Message, state: FSMContext, session: AsyncSession):
     uid = message.from_user.id
-    msg_ids[uid].add(message.message_id)
+    cached = await user_cache.load(uid, session)
+    cached.msg_ids.add(message.message_id)
     phone_num = message.text
     phone_pattern = re.compile(r"^\+7\d{10}$")
     if not phone_pattern.match(phone_num):
         msg = await message.answer("❌ Некорректный номер телефона. Попробуйте ещё раз.")
-        msg_ids[uid].add(msg.message_id)
+        cached.msg_ids.add(msg.message_id)
         return
-    user[uid]['phone'] = phone_num
+    cached.phone = phone_num
+    await user_cache.save(uid, session)
     msg = await message.answer('Введите E-mail для отправки чека')
-    msg_ids[uid].add(msg.message_id)
+    cached.msg_ids.add(msg.message_id)
     await state.set_state(States.email)
 
 
 @dp.message(States.email)
-async def email_handler(message: Message, state: FSMContext):
+async def email_handler(message: Message, state: FSMContext, session: AsyncSession):
     uid = message.from_user.id
-    msg_ids[uid].add(message.message_id)
+    cached = await user_cache.load(uid, session)
+    cached.msg_ids.add(message.message_id)
     email = message.text
     email_pattern = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
     if not email_pattern.match(email):
         msg = await message.answer("❌ Некорректный E-mail. Попробуйте ещё раз.")
-        msg_ids[uid].add(msg.message_id)
+        cached.msg_ids.add(msg.message_id)
         return
     await state.clear()
-    user[uid]['email'] = email
+    cached.email = email
+    await user_cache.save(uid, session)
     kw = {
-        'phone_number': user[uid]['phone'],
+        'phone_number': cached.phone,
         'email': email
     }
-    await db.update_user(uid, **kw)
+    await db.update_user(uid, **kw, session=session)
     # photo = FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png'))
     msg = await message.answer(
         'Для скольки устройств вы хотите подключить VPN?\n'
@@ -565,160 +563,280 @@ async def email_handler(message: Message, state: FSMContext):
         '(цены указаны за 1 устройство)',
         reply_markup=kb.nums
     )
-    msg_ids[uid].add(msg.message_id)
+    cached.msg_ids.add(msg.message_id)
 
 
 @dp.message(F.successful_payment)
-async def successful_payment_handler(message: Message):
+async def successful_payment_handler(message: Message, session: AsyncSession):
     uid = message.from_user.id
     payment_info = message.successful_payment
+    pld = payment_info.invoice_payload
+    credits_on_acc = int(pld.split('_')[2])
+    result = await db.fulfill_payment(
+        uid,
+        payment_info.telegram_payment_charge_id,
+        payment_info.total_amount,
+        payment_info.currency,
+        credits_on_acc,
+        session=session
+    )
+    # fulfill_payment коммитит оплату сам, поэтому сообщения ниже уходят уже после сохранения в БД
+    if result is None:
+        return
     try:  # Удаление лишних сообщений
-        for msg_id in msg_ids[uid]:
+        cached = user_cache.get(uid)
+        for msg_id in list(cached.msg_ids):
             await bot.delete_message(message.chat.id, msg_id)
+            cached.msg_ids.discard(msg_id)
     except Exception as e:
         logger.error(f"Ошибка при удалении сообщений: {e}")
     await message.answer(f"✅ Ваш платеж на сумму\n"
                          f"{payment_info.total_amount / 100} {payment_info.currency} "
                          f"был успешно обработан\n"
                          f"🤝 Спасибо, что Вы с нами!")
-    pld = payment_info.invoice_payload
-    credits_on_acc = int(pld.split('_')[2])
-    await db.update_user(
-        uid,
-        credits_on_account=credits_on_acc
-    )
-    summ = payment_info.total_amount / 100
-    invoice_data = await db.get_invoice_by_uid(uid)
-    number_of_configs = invoice_data['number_of_configs']
-    days = invoice_data['days_to_increase']
-    info = await db.get_user_data(uid)
-    ref_id = info['referrer']
-    my_credits = info['credits_on_account']
-    if ref_id is not None and ref_id != 'None':
-        ref_info = await db.get_user_data(ref_id)
-        ref_credits = ref_info['credits_on_account']
-        await db.update_user(
-            ref_id,
-            credits_on_account=ref_credits + int(summ * 0.25),
+    days = result['days']
+    if result['missing_invoice']:
+        await bot.send_message(
+            Config.ADMIN_ID,
+            f'Оплата пользователя {uid} ({payment_info.telegram_payment_charge_id}) '
+            'получена без инвойса, заказ нужно выдать вручную'
         )
-        await db.update_user(
-            uid,
-            credits_on_account=my_credits + int(summ * 0.25),
-            referrer='None'
+    elif result['shortage']:
+        await message.answer('⚠️ Сейчас недостаточно свободных конфигураций. '
+                             'Мы уже знаем об этом и выдадим их в ближайшее время.')
+        await bot.send_message(
+            Config.ADMIN_ID,
+            f'Не хватило конфигураций для оплаченного заказа пользователя {uid} '
+            f'({result["number_of_configs"]} шт.), необходимо добавить ещё. Заказ сохранён '
+            f'({payment_info.telegram_payment_charge_id}) и будет выдан, когда появятся свободные конфигурации'
         )
-    days_left = int(info['subscribe_days_left'])
-    days_for_db = days + days_left
-    now = datetime.now().strftime(format='%Y-%m-%d')
-    await db.update_user(uid, pay_date_time=now, subscribe_days_left=days_for_db)
-    invoice = await db.update_invoice(uid, paid=True, paid_at=now)
-    await db.delete_invoice(uid)
-    exp_date = (datetime.now() + timedelta(days=days)).strftime(format='%Y-%m-%d')
-    config_id = invoice['config_id']
-    if not config_id:
-        media_group = []
-        for i in range(number_of_configs):
-            user_config = await db.get_free_vpn_config(uid, exp_date, user[uid]['device'])
-            logger.info(f'{user_config}')
-            file = FSInputFile(path=user_config['filename'])
-            device = user_config['device']
-            media = InputMediaDocument(
-                media=file,
-                caption=captions[device].format(days=days),
-            )
-            media_group.append(media)
-        await message.answer_media_group(media_group)
-        await message.answer('Инструкция по кнопке ниже ⤵️',
-                             reply_markup=kb.get_instruction(user[uid]['device']),
-                             parse_mode="HTML",
-                             disable_web_page_preview=True)
+    elif result['renewed'] is None:
+        await send_order(uid, result['configs'], days, result['device'])
     else:
-        conf_info = await db.get_config_by_id(config_id)
-        expired_date = datetime.strptime(conf_info['expired'], '%Y-%m-%d')
-        new_expired_date = expired_date + timedelta(days=days)
-        exp_date_str = new_expired_date.strftime('%Y-%m-%d')
-        await db.update_exp_date(config_id, exp_date_str)
-        device = conf_info['device']
-        await message.answer(f'Ваша подписка для конфигурации {device} продлена на {days} дней.')
+        conf_info = result['renewed']
+        await subscriptions.enable_config(conf_info, session)
+        await message.answer(f'Ваша подписка для конфигурации {conf_info["device"]} продлена на {days} дней.')
 #    photo = FSInputFile(path=os.path.join(config.BASE_DIR, 'static/img.png'))
 #    await message.answer_photo(photo, reply_markup=kb.start_keyboard)
 
 
-async def check_subscriptions():
-    configs = await db.get_all_users()
-    for conf in configs:
-        device_id = conf['id']
-        uid = conf['uid']
-        device_type = conf['device']
-        filename = str(conf['filename'])
-        filename = os.path.basename(filename)
-        expired_date = datetime.strptime(conf['expired'], "%Y-%m-%d").date()
-        is_active = expired_date < datetime.now().date()
-        if is_active:
-            user_info = await db.get_user_data(uid)
-            days_left = user_info['subscribe_days_left']
-            phone = user_info['phone']
-            conf_id = conf['file_id']
-            if days_left == 0:
-                try:
-                    await bot.send_message(
-                        Config.CHANNEL_ID,
-                        f'У пользователя c id {uid} и '
-                        f'номером телефона: {phone} \n'
-                        'срок действия подписки закончился, оплата не внесена\n\n'
-                        'Ссылка на конфигурацию для отключения: \n'
-                        f'https://drive.google.com/file/d/{conf_id}/view?usp=drive_link'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке сообщения: {e}")
-                await asyncio.sleep(1)
-                try:
-                    await bot.send_message(uid, 'Здравствуйте!\n\n'
-                                                'Срок действия вашей подписки для конфигурации '
-                                                f'{device_type}_{uid}_{filename} истёк, рекомендуем её продлить.',
-                                           reply_markup=kb.back_to_acc(device_id))
-                    await last_notification(uid, device_id)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке сообщения: {e}")
-            elif days_left < 3:
-                try:
-                    await bot.send_message(
-                        Config.CHANNEL_ID,
-                        f'У пользователя с id {uid} '
-                        'срок действия подписки меньше 3-х дней, оплата не внесена'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке сообщения: {e}")
-                await asyncio.sleep(1)
-                try:
-                    await bot.send_message(uid, f'Здравствуйте!\n\n'
+def config_caption(device: str | None, days: int) -> str:
+    return captions.get(device, '✅ Ваша подписка продлена на {days} дней').format(days=days)
+
+
+async def send_order(uid: int, configs: list[dict], days: int, device: str | None):
+    """Отправляет пользователю выданные по заказу конфиги и кнопку инструкции."""
+    logger.info(f'{configs}')
+    await media.send_configs(bot, uid, configs, [config_caption(conf['device'], days) for conf in configs])
+    await bot.send_message(uid, 'Инструкция по кнопке ниже ⤵️',
+                           reply_markup=kb.get_instruction(device),
+                           parse_mode="HTML",
+                           disable_web_page_preview=True)
+
+
+async def issue_pending_orders():
+    """Выдаёт оплаченные заказы, на которые при оплате не хватило свободных конфигов."""
+    for order in await db.get_pending_orders():
+        # Заказы выдаются по очереди оплаты: пока не хватает на самый ранний, остальные ждут
+        if not await db.config_pool.has_free(order['number_of_configs']):
+            return
+        filled = await db.fill_pending_order(order['charge_id'])
+        if filled is None:
+            return
+        logger.info(f'Выдан отложенный заказ {order["charge_id"]} пользователя {order["uid"]}')
+        try:
+            await send_order(order['uid'], filled['configs'], order['days'], order['device'])
+        except Exception as e:
+            logger.error(f'Ошибка при отправке отложенного заказа пользователю {order["uid"]}: {e}')
+
+
+async def notify_config(conf: dict, expired_digest: notifications.Digest,
+                        expiring_digest: notifications.Digest) -> dict | None:
+    """Уведомляет об окончании подписки, возвращает отложенное напоминание, если оно нужно."""
+    device_id = conf['id']
+    uid = conf['uid']
+    filename = os.path.basename(str(conf['filename']))
+    name = f"{conf['device']}_{uid}_{filename}"
+    if conf['days_left'] < 0:
+        await expired_digest.add(
+            f'id {uid}, телефон {conf["phone_number"]}: '
+            f'https://drive.google.com/file/d/{conf["file_id"]}/view?usp=drive_link'
+        )
+        sent = await notifier.send_message(uid, 'Здравствуйте!\n\n'
                                                 'Срок действия вашей подписки для конфигурации '
-                                                f'{device_type}_{uid}_{filename} меньше 3-х дней, '
-                                                'рекомендуем её продлить.',
+                                                f'{name} истёк, рекомендуем её продлить.',
                                            reply_markup=kb.back_to_acc(device_id))
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке сообщения: {e}")
-            await asyncio.sleep(1)
+        if sent:
+            return last_notification(uid, device_id, conf['username'])
+    else:
+        await expiring_digest.add(f'id {uid}')
+        await notifier.send_message(uid, 'Здравствуйте!\n\n'
+                                         'Срок действия вашей подписки для конфигурации '
+                                         f'{name} меньше 3-х дней, рекомендуем её продлить.',
+                                    reply_markup=kb.back_to_acc(device_id))
+    return None
+
+
+async def check_subscriptions():
+    today = datetime.now().date()
+    await db.delete_sent_notifications_before(today - timedelta(days=7))
+    expired_digest = notifications.Digest(
+        notifier, Config.CHANNEL_ID,
+        'Срок действия подписки закончился, оплата не внесена. '
+        'Конфигурации будут отключены автоматически:'
+    )
+    expiring_digest = notifications.Digest(
+        notifier, Config.CHANNEL_ID,
+        'Срок действия подписки меньше 3-х дней, оплата не внесена:'
+    )
+    semaphore = asyncio.Semaphore(Config.NOTIFY_CONCURRENCY)
+    total = 0
+
+    async def notify(conf: dict) -> dict | None:
+        async with semaphore:
+            try:
+                return await notify_config(conf, expired_digest, expiring_digest)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления по конфигу {conf['id']}: {e}")
+
+    async for configs in db.iter_expiring_configs(today):
+        # Уже разосланные сегодня пропускаем: рассылка продолжается после рестарта
+        notified = await db.get_notified_config_ids([conf['id'] for conf in configs], today)
+        pending = [conf for conf in configs if conf['id'] not in notified]
+        for i in range(0, len(pending), Config.NOTIFY_CONCURRENCY):
+            chunk = pending[i:i + Config.NOTIFY_CONCURRENCY]
+            reminders = await asyncio.gather(*(notify(conf) for conf in chunk))
+            await db.schedule_notifications([reminder for reminder in reminders if reminder])
+            # Строки для канала отправляем до отметки: после сбоя отмеченные конфиги
+            # не рассылаются повторно, и их строки иначе бы потерялись
+            await expired_digest.flush()
+            await expiring_digest.flush()
+            await db.mark_configs_notified([conf['id'] for conf in chunk], today)
+            total += len(chunk)
+    notifier.forget_chats()
+    logger.info(f'Уведомления об окончании подписки отправлены: {total}')
+
+
+async def enforce_subscriptions():
+    stats = await subscriptions.enforce_subscriptions()
+    # Ошибки тоже сообщаем в канал: иначе несовпадение имён клиентов или недоступный wg-easy
+    # видны только в логе, а конфиги с истёкшей подпиской продолжают работать
+    if stats['disabled'] or stats['enabled'] or stats['failed']:
+        try:
+            await bot.send_message(
+                Config.CHANNEL_ID,
+                'Синхронизация подписок с VPN сервером:\n'
+                f'Отключено конфигураций: {stats["disabled"]}\n'
+                f'Включено после продления: {stats["enabled"]}\n'
+                f'Ошибок (повтор при следующем запуске): {stats["failed"]}'
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при отправке сообщения: {e}")
+
+
+REMINDER_DELAY = timedelta(days=3)
+REMINDER_RETRY_DELAY = timedelta(minutes=10)
+REMINDER_MAX_ATTEMPTS = 5
+REMINDER_BATCH_SIZE = 500
 
 
-async def last_notification(uid, device_id):
-    user_ = await bot.get_chat(uid)
-    name = user_.full_name
+def last_notification(uid: int, device_id: int, name: str) -> dict:
+    """Напоминание, которое уйдёт через 3 дня после окончания подписки."""
     text = f'''Здравствуйте, {name}!
 
 Срок действия вашей подписки закончился, для возобновления пользованием VPN, рекомендуем её подключить'''
-    scheduler.add_job(bot.send_message, DateTrigger(datetime.now() + timedelta(days=3)),
-                      args=[uid, text],
-                      kwargs={'reply_markup': kb.back_to_acc(device_id)})
+    return {
+        'uid': uid,
+        'text': text,
+        'config_id': device_id,
+        'send_at': datetime.now() + REMINDER_DELAY,
+    }
 
 
-async def main():
-    await db.init_db()
-    # ------------------------- Расписание задач -------------------------
+async def send_scheduled_notifications():
+    """Отправляет наступившие отложенные сообщения пачками; неотправленные переносит на потом."""
+    semaphore = asyncio.Semaphore(Config.NOTIFY_CONCURRENCY)
+
+    async def send(notification: dict) -> bool:
+        async with semaphore:
+            reply_markup = kb.back_to_acc(notification['config_id']) if notification['config_id'] else None
+            return await notifier.send_message(notification['uid'], notification['text'],
+                                               reply_markup=reply_markup)
+
+    total = 0
+    while True:
+        now = datetime.now()
+        due = await db.get_due_notifications(now, REMINDER_BATCH_SIZE)
+        if not due:
+            break
+        results = await asyncio.gather(*(send(notification) for notification in due))
+        done, retry = [], []
+        for notification, sent in zip(due, results):
+            if sent or notification['attempts'] + 1 >= REMINDER_MAX_ATTEMPTS:
+                done.append(notification['id'])
+            else:
+                retry.append(notification['id'])
+        await db.delete_scheduled_notifications(done)
+        await db.postpone_scheduled_notifications(retry, now + REMINDER_RETRY_DELAY)
+        total += len(due)
+    if total:
+        logger.info(f'Отложенных сообщений обработано: {total}')
+
+
+async def cleanup_user_cache():
+    # Незавершённые заказы старше недели уже не понадобятся
+    await db.delete_user_cache_before(datetime.now() - timedelta(days=7))
+
+
+async def cleanup_fsm_states():
+    deleted = await fsm_storage.cleanup(Config.FSM_STATE_TTL)
+    if deleted:
+        logger.info(f'Удалено устаревших состояний FSM: {deleted}')
+
+
+def schedule_jobs():
     scheduler.remove_all_jobs()  # сначала очищаем (если нужно)
-    scheduler.add_job(ggl.download_configs, trigger=IntervalTrigger(minutes=10))
-    scheduler.add_job(db.decrease_all_subscriptions, trigger=CronTrigger(hour=11, minute=40))
-    scheduler.add_job(check_subscriptions, trigger=CronTrigger(hour=12))
+    scheduler.add_job(ggl.download_configs, trigger=IntervalTrigger(minutes=10), max_instances=1, coalesce=True)
+    scheduler.add_job(issue_pending_orders, trigger=IntervalTrigger(minutes=10), max_instances=1, coalesce=True)
+    scheduler.add_job(check_subscriptions, trigger=CronTrigger(hour=12), max_instances=1, coalesce=True)
+    scheduler.add_job(enforce_subscriptions, trigger=IntervalTrigger(hours=1), max_instances=1, coalesce=True)
+    scheduler.add_job(send_scheduled_notifications, trigger=IntervalTrigger(minutes=1), max_instances=1, coalesce=True)
+    scheduler.add_job(cleanup_user_cache, trigger=CronTrigger(hour=4))
+    scheduler.add_job(cleanup_fsm_states, trigger=CronTrigger(hour=4, minute=10))
     scheduler.start()  # затем запускаем планировщик
-    #  -------------------------------------------------------------------
-    _ = asyncio.create_task(ggl.download_configs())
-    await dp.start_polling(bot)
+
+
+async def startup(run_jobs: bool = True):
+    """Подготовка процесса, обрабатывающего апдейты. Задачи по расписанию запускаются только при run_jobs."""
+    await db.init_db()
+    await media.load()
+    ggl.instructions_cache.refresh()
+    if run_jobs:
+        schedule_jobs()
+        _ = asyncio.create_task(ggl.download_configs())
+
+
+async def shutdown():
+    await state_expiry.stop()
+    await vpn_api.wg_client.close()
+
+
+async def main():
+    if not Config.WG_EASY_URL:
+        # Без wg-easy отключение истёкших подписок не работает, хотя уведомления обещают его
+        raise RuntimeError('Не задан WG_EASY_URL: бот не сможет отключать конфиги с истёкшей подпиской')
+    if Config.BOT_WORKERS > 1:
+        # Апдейты получает этот процесс, а обрабатывают воркеры (см. bot/sharding.py)
+        await db.init_db()
+        await sharding.run_supervisor(dp, bot, Config.BOT_WORKERS)
+        return
+    await startup(run_jobs=Config.RUN_SCHEDULED_JOBS)
+    try:
+        if Config.BOT_MODE == 'webhook':
+            await webhook.run_webhook(dp, bot)
+        else:
+            # Пока установлен вебхук, getUpdates не работает
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await shutdown()
@@ -2,6 +2,7 @@ import os
 from typing import Optional
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import db
 
@@ -44,9 +45,10 @@ nums = ReplyKeyboardMarkup(keyboard=[
 
 
 async def account(
-        uid: int
+        uid: int,
+        session: AsyncSession | None = None
 ) -> Optional[InlineKeyboardMarkup]:
-    user_devices = await db.get_user_devices(uid)
+    user_devices = await db.get_user_devices(uid, session=session)
     keyboard = []
 
     if not user_devices:
@@ -0,0 +1,143 @@
+import os
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, FSInputFile, InputMediaPhoto, InputMediaDocument
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+import db
+from utils import logger
+
+MAIN_IMAGE = 'static/img.png'
+
+# Ключ (путь к файлу относительно проекта или ссылка) -> file_id в Telegram
+_file_ids: dict[str, str] = {}
+
+
+async def load():
+    """Загружает сохранённые file_id из БД, чтобы не загружать файлы повторно после рестарта."""
+    _file_ids.update(await db.get_media_file_ids())
+    logger.info(f'Загружено {len(_file_ids)} file_id медиафайлов')
+
+
+def get(key: str) -> str | FSInputFile:
+    """Возвращает file_id, если файл уже загружался, иначе сам файл или ссылку для первой загрузки."""
+    if key in _file_ids:
+        return _file_ids[key]
+    path = os.path.join(config.BASE_DIR, key)
+    if os.path.isfile(path):
+        return FSInputFile(path=path)
+    return key
+
+
+async def remember(key: str, msg: Message | bool, session: AsyncSession | None = None):
+    # edit_media возвращает True для inline-сообщений, там file_id взять неоткуда
+    if key in _file_ids or not isinstance(msg, Message) or not msg.photo:
+        return
+    file_id = msg.photo[-1].file_id
+    _file_ids[key] = file_id
+    await db.save_media_file_id(key, file_id, session=session)
+
+
+def _is_stale_file_id(e: TelegramBadRequest) -> bool:
+    text = str(e).lower()
+    return 'file identifier' in text or 'file_id' in text or 'file_reference' in text
+
+
+async def _send(key: str, send: Callable[[str | FSInputFile], Awaitable[Message | bool]],
+                session: AsyncSession | None = None) -> Message | bool:
+    cached = key in _file_ids
+    try:
+        msg = await send(get(key))
+    except TelegramBadRequest as e:
+        if not cached or not _is_stale_file_id(e):
+            raise
+        logger.warning(f'Telegram отклонил file_id для {key}, загружаем файл заново: {e}')
+        _file_ids.pop(key, None)
+        msg = await send(get(key))
+    await remember(key, msg, session)
+    return msg
+
+
+async def answer_photo(message: Message, key: str = MAIN_IMAGE, session: AsyncSession | None = None,
+                       **kwargs) -> Message:
+    return await _send(key, lambda photo: message.answer_photo(photo, **kwargs), session)
+
+
+async def edit_photo(message: Message, key: str = MAIN_IMAGE, caption: str | None = None,
+                     session: AsyncSession | None = None, **kwargs) -> Message | bool:
+    return await _send(
+        key,
+        lambda photo: message.edit_media(InputMediaPhoto(media=photo, caption=caption), **kwargs),
+        session
+    )
+
+
+async def send_photo(bot: Bot, chat_id: int, key: str, session: AsyncSession | None = None,
+                     **kwargs) -> Message:
+    return await _send(key, lambda photo: bot.send_photo(chat_id=chat_id, photo=photo, **kwargs), session)
+
+
+async def _save_config_file_id(conf: dict, msg: Message, session: AsyncSession | None = None):
+    if msg.document and msg.document.file_id != conf['tg_file_id']:
+        conf['tg_file_id'] = msg.document.file_id
+        await db.update_config_tg_file_id(conf['id'], msg.document.file_id, session=session)
+
+
+async def send_config(bot: Bot, chat_id: int, conf: dict, session: AsyncSession | None = None,
+                      **kwargs) -> Message:
+    """Отправляет .conf файл конфигурации, после первой загрузки - по сохранённому file_id."""
+    cached = conf['tg_file_id']
+    try:
+        msg = await bot.send_document(chat_id, cached or FSInputFile(conf['filename']), **kwargs)
+    except TelegramBadRequest as e:
+        if not cached or not _is_stale_file_id(e):
+            raise
+        logger.warning(f'Telegram отклонил file_id конфига {conf["id"]}, загружаем файл заново: {e}')
+        conf['tg_file_id'] = None
+        msg = await bot.send_document(chat_id, FSInputFile(conf['filename']), **kwargs)
+    await _save_config_file_id(conf, msg, session)
+    return msg
+
+
+async def answer_config(message: Message, conf: dict, session: AsyncSession | None = None,
+                        **kwargs) -> Message:
+    return await send_config(message.bot, message.chat.id, conf, session, **kwargs)
+
+
+async def send_configs(bot: Bot, chat_id: int, configs: list[dict], captions: list[str],
+                       session: AsyncSession | None = None):
+    """Отправляет несколько конфигураций альбомами (не больше 10 файлов в альбоме)."""
+    for i in range(0, len(configs), 10):
+        chunk = list(zip(configs[i:i + 10], captions[i:i + 10]))
+        if len(chunk) == 1:
+            # Альбом должен содержать минимум 2 файла
+            conf, caption = chunk[0]
+            await send_config(bot, chat_id, conf, session, caption=caption)
+            continue
+
+        def build(use_cache: bool) -> list[InputMediaDocument]:
+            return [
+                InputMediaDocument(
+                    media=(use_cache and conf['tg_file_id']) or FSInputFile(conf['filename']),
+                    caption=caption,
+                )
+                for conf, caption in chunk
+            ]
+
+        try:
+            messages = await bot.send_media_group(chat_id, build(use_cache=True))
+        except TelegramBadRequest as e:
+            if not any(conf['tg_file_id'] for conf, _ in chunk) or not _is_stale_file_id(e):
+                raise
+            logger.warning(f'Telegram отклонил file_id конфигов, загружаем файлы заново: {e}')
+            messages = await bot.send_media_group(chat_id, build(use_cache=False))
+        for (conf, _), msg in zip(chunk, messages):
+            await _save_config_file_id(conf, msg, session)
+
+
+async def answer_configs(message: Message, configs: list[dict], captions: list[str],
+                         session: AsyncSession | None = None):
+    await send_configs(message.bot, message.chat.id, configs, captions, session)
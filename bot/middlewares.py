@@ -0,0 +1,33 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from db.models import async_session
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию БД на апдейт и передаёт её обработчику в аргументе session.
+
+    Запросы db коммитят свои изменения сразу (см. db.requests.with_session), чтобы
+    блокировка записи SQLite не держалась, пока обработчик ждёт Telegram. Здесь
+    коммитится только то, что обработчик изменил в сессии напрямую, а при ошибке
+    оно откатывается.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any],
+    ) -> Any:
+        async with async_session() as session:
+            data['session'] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            await session.commit()
+            return result
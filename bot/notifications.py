@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramAPIError
+
+from config import Config
+from utils import logger, TokenBucket
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class Notifier:
+    """
+    Рассылка сообщений с учётом лимитов Telegram.
+
+    Общая частота ограничена TokenBucket (около 30 сообщений в секунду на бота),
+    в один чат сообщения уходят не чаще, чем раз в chat_interval секунд.
+    На RetryAfter рассылка целиком ставится на паузу на указанное время,
+    а скорость снижается и затем постепенно восстанавливается.
+    """
+
+    def __init__(self, bot: Bot, rate: float, chat_interval: float, max_retries: int = 3):
+        self.bot = bot
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.limiter = TokenBucket(rate)
+        self._chat_next: dict[int | str, float] = {}
+        self._paused_until = 0.0
+
+    async def _wait_turn(self, chat_id: int | str, interval: float):
+        now = time.monotonic()
+        # Резервируем слот в чате заранее, чтобы параллельные отправки в один чат шли по очереди
+        slot = max(now, self._chat_next.get(chat_id, 0))
+        self._chat_next[chat_id] = slot + interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        await self.limiter.acquire()
+        # Пауза могла начаться, пока ждали очереди
+        while (pause := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(pause)
+
+    async def send_message(self, chat_id: int | str, text: str, interval: float | None = None,
+                           **kwargs) -> bool:
+        """Отправляет сообщение, возвращает False, если доставить его не удалось."""
+        interval = self.chat_interval if interval is None else interval
+        for attempt in range(1, self.max_retries + 1):
+            await self._wait_turn(chat_id, interval)
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                self.limiter.back_off()
+                logger.warning(f'Telegram ограничил рассылку на {e.retry_after} с, '
+                               f'скорость снижена до {self.limiter.rate:.1f}/с')
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота - повторять бессмысленно
+                return False
+            except TelegramAPIError as e:
+                logger.error(f'Ошибка при отправке сообщения в {chat_id}: {e}')
+                return False
+            else:
+                self.limiter.recover()
+                return True
+        logger.error(f'Не удалось отправить сообщение в {chat_id} после {self.max_retries} попыток')
+        return False
+
+    def forget_chats(self):
+        """Очищает очередь слотов по чатам после окончания рассылки."""
+        now = time.monotonic()
+        self._chat_next = {chat_id: slot for chat_id, slot in self._chat_next.items() if slot > now}
+
+
+class Digest:
+    """
+    Копит строки уведомлений для админского канала и отправляет их сводными
+    сообщениями вместо отдельного сообщения на каждого пользователя.
+    """
+
+    def __init__(self, notifier: Notifier, chat_id: int | str, header: str):
+        self.notifier = notifier
+        self.chat_id = chat_id
+        self.header = header
+        self._lines: list[str] = []
+        self._length = len(header) + 1
+
+    async def add(self, line: str):
+        if self._lines and self._length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            await self.flush()
+        self._lines.append(line)
+        self._length += len(line) + 1
+
+    async def flush(self):
+        if not self._lines:
+            return
+        text = self.header + '\n\n' + '\n'.join(self._lines)
+        self._lines = []
+        self._length = len(self.header) + 1
+        await self.notifier.send_message(
+            self.chat_id,
+            text[:MAX_MESSAGE_LENGTH],
+            interval=Config.TG_CHANNEL_INTERVAL,
+            disable_web_page_preview=True,
+        )
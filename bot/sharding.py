@@ -0,0 +1,220 @@
+import asyncio
+import multiprocessing
+import queue
+import secrets
+import signal
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+from bot import webhook
+from config import Config
+from utils import logger
+
+# Сигнал воркеру завершиться после обработки уже полученных апдейтов
+STOP = None
+
+
+def update_uid(update: dict[str, Any]) -> int:
+    """Пользователь, от которого пришёл апдейт (для чатов без пользователя - id чата)."""
+    for key, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        if chat := event.get('chat'):
+            return chat['id']
+    return update['update_id']
+
+
+class KeyedSequencer:
+    """
+    Обрабатывает задачи одного ключа строго по очереди, а разных ключей - параллельно.
+
+    Каждая новая задача ключа ждёт завершения предыдущей (даже если та упала),
+    поэтому апдейты одного пользователя обрабатываются в порядке поступления.
+    """
+
+    def __init__(self):
+        self._tails: dict[int, asyncio.Task] = {}
+
+    async def _run(self, previous: asyncio.Task | None, coro: Awaitable):
+        if previous is not None:
+            await asyncio.wait([previous])
+        await coro
+
+    def _release(self, key: int, task: asyncio.Task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    def submit(self, key: int, coro: Awaitable) -> asyncio.Task:
+        task = asyncio.create_task(self._run(self._tails.get(key), coro))
+        self._tails[key] = task
+        task.add_done_callback(lambda t: self._release(key, t))
+        return task
+
+    async def join(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def consume_updates(updates: multiprocessing.Queue, handle: Callable[[dict], Awaitable], batch_size: int = 100):
+    """Читает апдейты воркера из очереди и обрабатывает их по очереди для каждого пользователя."""
+    loop = asyncio.get_running_loop()
+    sequencer = KeyedSequencer()
+
+    async def process(update: dict):
+        try:
+            await handle(update)
+        except Exception as e:
+            logger.error(f'Ошибка при обработке апдейта {update.get("update_id")}: {e}')
+
+    while True:
+        # Блокирующее ожидание - в потоке, остальное, что уже пришло, забираем без ожидания
+        batch = [await loop.run_in_executor(None, updates.get)]
+        while batch[-1] is not STOP and len(batch) < batch_size:
+            try:
+                batch.append(updates.get_nowait())
+            except queue.Empty:
+                break
+        for item in batch:
+            if item is STOP:
+                await sequencer.join()
+                return
+            uid, update = item
+            sequencer.submit(uid, process(update))
+
+
+async def _run_worker(index: int, updates: multiprocessing.Queue):
+    from bot import handler
+
+    await handler.startup(run_jobs=index == 0 and Config.RUN_SCHEDULED_JOBS)
+    await handler.dp.emit_startup(bot=handler.bot, dispatcher=handler.dp)
+
+    async def handle(update: dict):
+        result = await handler.dp.feed_raw_update(handler.bot, update)
+        if isinstance(result, TelegramMethod):
+            await handler.dp.silent_call_request(handler.bot, result)
+
+    try:
+        logger.info(f'Воркер {index} запущен' + (' (с задачами по расписанию)' if index == 0 else ''))
+        await consume_updates(updates, handle)
+    finally:
+        await handler.dp.emit_shutdown(bot=handler.bot, dispatcher=handler.dp)
+        await handler.shutdown()
+        await handler.bot.session.close()
+
+
+def worker_main(index: int, updates: multiprocessing.Queue):
+    # Ctrl+C получает вся группа процессов, воркер же завершается по STOP от супервизора
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, updates))
+
+
+class Supervisor:
+    """
+    Раздаёт апдейты N процессам-воркерам по хешу uid.
+
+    Все апдейты пользователя попадают в один и тот же воркер и обрабатываются
+    им по очереди, поэтому порядок сохраняется, а кеши пользователя в памяти
+    воркера (UserCache, StateExpiry, FSM) остаются согласованными. Упавший
+    воркер перезапускается с той же очередью.
+    """
+
+    def __init__(self, workers: int, target: Callable[..., None] = worker_main, args: tuple = ()):
+        self.workers = workers
+        self.target = target
+        self.args = args
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes: list[multiprocessing.Process | None] = [None] * workers
+        self._monitor_task: asyncio.Task | None = None
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=self.target, args=(index, self.queues[index], *self.args), name=f'bot-worker-{index}', daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error(f'Воркер {index} завершился с кодом {process.exitcode}, перезапуск')
+                    self._spawn(index)
+
+    def dispatch(self, update: dict[str, Any]):
+        uid = update_uid(update)
+        self.queues[uid % self.workers].put((uid, update))
+
+    async def stop(self, timeout: float = 30):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        for updates in self.queues:
+            updates.put(STOP)
+        loop = asyncio.get_running_loop()
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f'Воркер {index} не завершился за {timeout} с, останавливаем принудительно')
+                process.terminate()
+
+
+async def poll_updates(dp: Dispatcher, bot: Bot, supervisor: Supervisor, timeout: int = 30):
+    """Long polling в супервизоре: апдейты не обрабатываются, а раздаются воркерам."""
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                            request_timeout=timeout + 10)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramAPIError as e:
+            logger.warning(f'Ошибка при получении апдейтов: {e}')
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            supervisor.dispatch(update.model_dump(mode='json', exclude_none=True))
+            offset = update.update_id + 1
+
+
+def create_webhook_app(supervisor: Supervisor, secret_token: str) -> web.Application:
+    """Вебхук супервизора: проверяет секрет, отдаёт апдейт воркеру и сразу отвечает 200."""
+    async def handle(request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret_token):
+            return web.Response(status=401, text='Unauthorized')
+        supervisor.dispatch(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(Config.WEBHOOK_PATH, handle)
+    return app
+
+
+async def run_supervisor(dp: Dispatcher, bot: Bot, workers: int):
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    logger.info(f'Супервизор запущен, воркеров: {workers}')
+    try:
+        if Config.BOT_MODE == 'webhook':
+            secret_token = webhook.webhook_secret()
+            await webhook.serve_webhook(create_webhook_app(supervisor, secret_token), dp, bot, secret_token)
+        else:
+            await bot.delete_webhook()
+            await poll_updates(dp, bot, supervisor)
+    finally:
+        await supervisor.stop()
+        await bot.session.close()
@@ -0,0 +1,77 @@
+import asyncio
+import os
+from datetime import date
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import db
+from config import Config
+from integrations import vpn_api
+from utils import logger
+
+
+def client_name(conf: dict) -> str:
+    """Имя клиента в wg-easy - имя .conf файла без расширения."""
+    return os.path.splitext(os.path.basename(str(conf['filename'])))[0]
+
+
+async def _apply(configs: list[dict], action: str) -> tuple[list[int], list[int]]:
+    """Выполняет enable/disable для конфигов параллельно, не больше WG_EASY_CONCURRENCY запросов сразу."""
+    semaphore = asyncio.Semaphore(Config.WG_EASY_CONCURRENCY)
+    method = getattr(vpn_api.wg_client, action)
+
+    async def apply(conf: dict) -> bool:
+        async with semaphore:
+            try:
+                await method(client_name(conf))
+                return True
+            except Exception as e:
+                logger.error(f'Не удалось выполнить {action} для конфига {conf["id"]}: {e}')
+                return False
+
+    results = await asyncio.gather(*(apply(conf) for conf in configs))
+    done = [conf['id'] for conf, ok in zip(configs, results) if ok]
+    failed = [conf['id'] for conf, ok in zip(configs, results) if not ok]
+    return done, failed
+
+
+async def enforce_subscriptions() -> dict[str, int]:
+    """
+    Приводит состояние клиентов wg-easy в соответствие с подписками.
+
+    Отключает конфиги с истёкшей подпиской и включает обратно продлённые. В БД
+    отмечаются только успешные операции, поэтому повторный запуск безопасен,
+    а неудачные попытки повторятся при следующем запуске.
+    """
+    today = date.today()
+    to_disable = await db.get_configs_to_disable(today)
+    to_enable = await db.get_configs_to_enable(today)
+    if not to_disable and not to_enable:
+        return {'disabled': 0, 'enabled': 0, 'failed': 0}
+
+    disabled, disable_failed = await _apply(to_disable, 'disable')
+    await db.set_configs_disabled(disabled, True)
+    enabled, enable_failed = await _apply(to_enable, 'enable')
+    await db.set_configs_disabled(enabled, False)
+
+    stats = {
+        'disabled': len(disabled),
+        'enabled': len(enabled),
+        'failed': len(disable_failed) + len(enable_failed),
+    }
+    logger.info(f'Синхронизация подписок с wg-easy: {stats}')
+    return stats
+
+
+async def enable_config(conf: dict, session: AsyncSession | None = None) -> bool:
+    """Включает отключённый конфиг сразу после продления подписки."""
+    if not conf['disabled']:
+        return True
+    try:
+        await vpn_api.wg_client.enable(client_name(conf))
+    except Exception as e:
+        # Конфиг включит следующий запуск enforce_subscriptions
+        logger.error(f'Не удалось включить конфиг {conf["id"]} после продления: {e}')
+        return False
+    await db.set_configs_disabled([conf['id']], False, session=session)
+    return True
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import db
+from config import Config
+
+
+class CachedUser:
+    """Временные данные пользователя: выбранное устройство, контакты для чека, сообщения для удаления."""
+    __slots__ = ('device', 'phone', 'email', 'msg_ids', 'touched_at', 'loaded', 'synced_at')
+
+    def __init__(self):
+        self.device: str | None = None
+        self.phone: str | None = None
+        self.email: str | None = None
+        self.msg_ids: set[int] = set()
+        self.touched_at = time.monotonic()
+        self.loaded = False
+        self.synced_at: datetime | None = None  # updated_at записи в БД, с которой совпадают данные
+
+
+class UserCache:
+    """
+    Хранилище временных данных пользователей с ограниченным размером.
+
+    Записи вытесняются по LRU, если их больше max_size, и после ttl секунд
+    без активности. Если persist включён, устройство и контакты сохраняются
+    в БД (save) и подгружаются после рестарта (load), поэтому оплата
+    проходит, даже если бот перезапускался во время оформления заказа.
+
+    Если shared включён (пользователя обслуживают несколько процессов), load
+    при каждом вызове проверяет запись в БД и берёт её данные, если она новее
+    сохранённой этим процессом.
+    """
+
+    def __init__(self, max_size: int, ttl: float, persist: bool, shared: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        self.shared = shared
+        self._users: OrderedDict[int, CachedUser] = OrderedDict()
+
+    def _evict(self, now: float):
+        # В начале словаря - пользователи, дольше всех не проявлявшие активность
+        while self._users:
+            uid, cached = next(iter(self._users.items()))
+            if len(self._users) <= self.max_size and now - cached.touched_at <= self.ttl:
+                break
+            del self._users[uid]
+
+    def get(self, uid: int) -> CachedUser:
+        """Запись пользователя в памяти (создаётся при первом обращении)."""
+        now = time.monotonic()
+        cached = self._users.get(uid)
+        if cached is None:
+            cached = self._users[uid] = CachedUser()
+        else:
+            self._users.move_to_end(uid)
+        cached.touched_at = now
+        self._evict(now)
+        return cached
+
+    async def load(self, uid: int, session: AsyncSession | None = None) -> CachedUser:
+        """Как get, но при первом обращении после рестарта восстанавливает данные из БД."""
+        cached = self.get(uid)
+        if not self.persist or (cached.loaded and not self.shared):
+            return cached
+        cached.loaded = True
+        entry = await db.get_user_cache(uid, session=session)
+        if entry is None or (cached.synced_at is not None and entry['updated_at'] <= cached.synced_at):
+            return cached
+        cached.synced_at = entry['updated_at']
+        if self.shared:
+            # Запись сохранил другой процесс позже этого - она и актуальна
+            cached.device, cached.phone, cached.email = entry['device'], entry['phone'], entry['email']
+        else:
+            cached.device = cached.device or entry['device']
+            cached.phone = cached.phone or entry['phone']
+            cached.email = cached.email or entry['email']
+        return cached
+
+    async def save(self, uid: int, session: AsyncSession | None = None):
+        if not self.persist or uid not in self._users:
+            return
+        cached = self._users[uid]
+        cached.synced_at = await db.save_user_cache(uid, cached.device, cached.phone, cached.email, session=session)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+user_cache = UserCache(
+    Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL, Config.USER_CACHE_PERSIST, Config.USER_CACHE_SHARED
+)
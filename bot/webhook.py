@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import Config
+from utils import logger
+
+
+class WebhookRequestHandler(SimpleRequestHandler):
+    """
+    Принимает апдейты от Telegram: проверяет секретный токен, сразу отвечает 200,
+    а обработчики выполняются в фоне. При остановке сервера дожидается уже
+    принятых апдейтов, чтобы не потерять их при деплое.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, shutdown_timeout: float = 30):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token)
+        self.shutdown_timeout = shutdown_timeout
+
+    async def close(self) -> None:
+        if self._background_feed_update_tasks:
+            _, pending = await asyncio.wait(self._background_feed_update_tasks, timeout=self.shutdown_timeout)
+            if pending:
+                logger.warning(f'Не дождались обработки {len(pending)} апдейтов при остановке')
+        await super().close()
+
+
+def webhook_secret() -> str:
+    """Секрет из WEBHOOK_SECRET, иначе - производный от токена бота (одинаковый во всех процессах)."""
+    return Config.WEBHOOK_SECRET or hashlib.sha256(f'webhook:{Config.BOT_TOKEN}'.encode()).hexdigest()
+
+
+def create_app(dp: Dispatcher, bot: Bot, path: str, secret_token: str) -> web.Application:
+    app = web.Application()
+    WebhookRequestHandler(dp, bot, secret_token).register(app, path=path)
+    # startup/shutdown диспетчера, как при polling (в т.ч. закрытие хранилища FSM)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def serve_webhook(app: web.Application, dp: Dispatcher, bot: Bot, secret_token: str):
+    """Запускает aiohttp сервер с приложением app и регистрирует вебхук в Telegram."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, Config.WEBHOOK_HOST, Config.WEBHOOK_PORT).start()
+        # Регистрируем вебхук только после старта сервера, чтобы первые апдейты не получили отказ
+        await bot.set_webhook(
+            url=Config.WEBHOOK_URL.rstrip('/') + Config.WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f'Вебхук запущен на {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}')
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    secret_token = webhook_secret()
+    await serve_webhook(create_app(dp, bot, Config.WEBHOOK_PATH, secret_token), dp, bot, secret_token)
@@ -1,4 +1,5 @@
 import os
+import warnings
 
 from dotenv import load_dotenv
 
@@ -15,9 +16,68 @@ class Config:
     SHEET_ID = os.getenv('SHEET_ID')
     GOOGLE_CREDENTIALS_JSON = os.path.join(BASE_DIR, os.getenv('GOOGLE_CREDENTIALS_JSON'))
     DB_URL = f"sqlite+aiosqlite:///{BASE_DIR}/db/database/{os.getenv('DB_NAME')}"
+    # Настройки SQLite, применяемые к каждому новому соединению. SQLITE_TUNING=0 отключает их
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 10000)),  # мс
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64000)),  # отрицательное значение - в КиБ
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'temp_store': os.getenv('SQLITE_TEMP_STORE', 'MEMORY'),
+    } if os.getenv('SQLITE_TUNING', '1') != '0' else {}
+    SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 5))
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     LOG_ROTATE_DAYS = 1
     FOLDER_ID = os.getenv('FOLDER_ID')
     PROVIDER_TOKEN = os.getenv('PROVIDER_TOKEN')
     CHANNEL_ID = os.getenv('CHANNEL_ID')
-    ADMIN_ID = os.getenv('ADMIN_ID')
\ No newline at end of file
+    ADMIN_ID = os.getenv('ADMIN_ID')
+    WG_EASY_URL = os.getenv('WG_EASY_URL')  # Например, http://127.0.0.1:51821
+    WG_EASY_PASSWORD = os.getenv('WG_EASY_PASSWORD')
+    WG_EASY_CONCURRENCY = int(os.getenv('WG_EASY_CONCURRENCY', 10))  # Одновременные запросы к wg-easy
+    WG_EASY_INDEX_TTL = int(os.getenv('WG_EASY_INDEX_TTL', 3600))  # Полное обновление индекса клиентов, сек
+    GOOGLE_API_WORKERS = int(os.getenv('GOOGLE_API_WORKERS', 8))  # Потоки для блокирующих вызовов Google API
+    GOOGLE_API_TIMEOUT = int(os.getenv('GOOGLE_API_TIMEOUT', 30))  # Таймаут одного вызова Google API, сек
+    DRIVE_DOWNLOAD_WORKERS = int(os.getenv('DRIVE_DOWNLOAD_WORKERS', 4))  # Параллельные загрузки конфигов
+    DRIVE_RATE_LIMIT = float(os.getenv('DRIVE_RATE_LIMIT', 10))  # Запросов к Drive в секунду
+    INSTRUCTIONS_TTL = int(os.getenv('INSTRUCTIONS_TTL', 600))  # Время жизни кеша инструкций, сек
+    TG_RATE_LIMIT = float(os.getenv('TG_RATE_LIMIT', 25))  # Сообщений в секунду всем чатам (лимит Telegram - 30)
+    TG_CHAT_INTERVAL = float(os.getenv('TG_CHAT_INTERVAL', 1))  # Минимальный интервал между сообщениями в чат, сек
+    TG_CHANNEL_INTERVAL = float(os.getenv('TG_CHANNEL_INTERVAL', 3))  # То же для канала (лимит - 20 в минуту)
+    NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', 20))  # Одновременно отправляемые уведомления
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))  # Пользователей в памяти, дальше вытесняются (LRU)
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 24 * 3600))  # Время жизни в памяти без активности, сек
+    USER_CACHE_PERSIST = os.getenv('USER_CACHE_PERSIST', '1') != '0'  # Сохранять данные заказа в БД
+    FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', 0.5))  # Пакетная запись состояний FSM в БД, сек
+    FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', 30))  # Через сколько перечитывать состояние из БД, сек
+    FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', 7 * 24 * 3600))  # Неизменные дольше состояния удаляются, сек
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')  # polling или webhook
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес бота, например https://bot.example.com
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # По умолчанию выводится из BOT_TOKEN
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')  # Где слушает локальный сервер (за прокси/балансировщиком)
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))  # Одновременных запросов от Telegram
+    BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))  # Процессов-обработчиков; больше 1 - апдейты раздаёт супервизор
+    # Задачи по расписанию (уведомления, отключение подписок, загрузка конфигов) должны идти в одном процессе.
+    # При нескольких экземплярах бота за балансировщиком задайте 0 везде, кроме одного
+    RUN_SCHEDULED_JOBS = os.getenv('RUN_SCHEDULED_JOBS', '1') != '0'
+    # Одних и тех же пользователей обслуживают несколько процессов (вебхук за балансировщиком):
+    # состояние FSM читается из БД и записывается сразу, без локального кеша
+    FSM_SHARED = os.getenv('FSM_SHARED', '1' if BOT_MODE == 'webhook' else '0') != '0'
+    # То же для данных заказа (UserCache): при каждой загрузке проверяется, не изменил ли их другой процесс
+    USER_CACHE_SHARED = os.getenv('USER_CACHE_SHARED', '1' if FSM_SHARED else '0') != '0'
+    # Как часто сверять счётчик свободных конфигов с БД, сек (0 - при каждой проверке)
+    CONFIG_POOL_RECONCILE_INTERVAL = int(os.getenv(
+        'CONFIG_POOL_RECONCILE_INTERVAL', 0 if BOT_WORKERS > 1 or BOT_MODE == 'webhook' else 300
+    ))
+
+
+# SQLite пишет по одной транзакции за раз, поэтому на обработчиках с запросами к БД воркеры
+# не ускоряют бота, а при тысячах одновременных пользователей ещё и ждут друг друга на блокировке
+# записи (см. benchmarks/sharded_workers.py --db). Воркеры помогают только при работе на CPU
+if Config.BOT_WORKERS > 1 and Config.DB_URL.startswith('sqlite'):
+    warnings.warn(
+        f'BOT_WORKERS={Config.BOT_WORKERS} с SQLite: запись в БД идёт по одной транзакции за раз, '
+        'и пропускная способность с числом воркеров не растёт'
+    )
@@ -1,2 +1,4 @@
 from db.models import *
-from db.requests import *
\ No newline at end of file
+from db.requests import *
+from db.inventory import *
+from db.payments import *
@@ -0,0 +1,84 @@
+import time
+from datetime import date
+
+from sqlalchemy import select, func, case, false
+
+from config import Config
+from db.models import async_session, VpnConfig
+
+
+class ConfigPool:
+    """
+    Учёт свободных конфигов без загрузки таблицы.
+
+    Счётчик хранится в памяти и меняется при выдаче и загрузке конфигов,
+    а периодически сверяется с COUNT по частичному индексу ix_vpn_configs_free
+    (например, если конфиги добавлены другим процессом).
+    """
+
+    def __init__(self, reconcile_interval: int = 300):
+        self.reconcile_interval = reconcile_interval
+        self._free: int | None = None
+        self._reconciled_at: float = 0
+
+    async def reconcile(self) -> int:
+        async with async_session() as session:
+            result = await session.execute(
+                select(func.count()).select_from(VpnConfig).where(VpnConfig.assigned == false())
+            )
+            self._free = result.scalar_one()
+        self._reconciled_at = time.monotonic()
+        return self._free
+
+    def _is_stale(self, max_age: float) -> bool:
+        return self._free is None or time.monotonic() - self._reconciled_at > max_age
+
+    async def free(self) -> int:
+        if self._is_stale(self.reconcile_interval):
+            await self.reconcile()
+        return self._free
+
+    async def has_free(self, count: int = 1) -> bool:
+        if await self.free() >= count:
+            return True
+        # Перед отказом пересчитываем, но не чаще раза в 10 секунд
+        if self._is_stale(10):
+            return await self.reconcile() >= count
+        return False
+
+    def add(self, count: int):
+        if self._free is not None:
+            self._free += count
+
+    def take(self, count: int):
+        if self._free is not None:
+            self._free = max(0, self._free - count)
+
+
+# Если конфиги выдают несколько процессов, счётчик одного не знает о выдачах в других,
+# поэтому там он пересчитывается при каждой проверке
+config_pool = ConfigPool(Config.CONFIG_POOL_RECONCILE_INTERVAL)
+
+
+async def count_configs_by_status() -> dict[str, int]:
+    """Количество конфигов по состояниям: свободные, активные, истёкшие, отключённые."""
+    today = date.today()
+    assigned = VpnConfig.assigned.is_(True)
+    async with async_session() as session:
+        result = await session.execute(
+            select(
+                func.count(),
+                func.count(case((VpnConfig.assigned.is_(False), 1))),
+                func.count(case((assigned & (VpnConfig.expired >= today), 1))),
+                func.count(case((assigned & (VpnConfig.expired < today), 1))),
+                func.count(case((VpnConfig.disabled.is_(True), 1))),
+            ).select_from(VpnConfig)
+        )
+        total, free, active, expired, disabled = result.one()
+    return {
+        'total': total,
+        'free': free,
+        'active': active,
+        'expired': expired,
+        'disabled': disabled,
+    }
@@ -1,12 +1,31 @@
+from datetime import date, datetime
 from typing import cast
 
-from sqlalchemy import String, Float, ForeignKey, inspect
+from sqlalchemy import String, Float, Date, DateTime, ForeignKey, Index, event, inspect, false, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Mapper
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine, AsyncSession, AsyncEngine
 
 from config import Config
 
-engine = create_async_engine(url=Config.DB_URL)
+
+def set_sqlite_pragmas(engine: AsyncEngine, pragmas: dict):
+    """Применяет PRAGMA к каждому новому соединению движка."""
+    @event.listens_for(engine.sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+# Каждое соединение aiosqlite - отдельный поток. В WAL читатели не блокируют друг друга,
+# а писатель всё равно один, поэтому большой пул не нужен
+engine = create_async_engine(
+    url=Config.DB_URL,
+    pool_size=Config.SQLITE_POOL_SIZE,
+    max_overflow=Config.SQLITE_POOL_SIZE,
+)
+set_sqlite_pragmas(engine, Config.SQLITE_PRAGMAS)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
@@ -30,8 +49,9 @@ class User(Base):
     phone_number: Mapped[str] = mapped_column(String(11), nullable=True)
     email: Mapped[str] = mapped_column(String(150), nullable=True)
     pay_date_time: Mapped[str] = mapped_column(String(150), nullable=True)
-    subscribe_days_left: Mapped[int] = mapped_column(default=0)
-    referrer: Mapped[int] = mapped_column(nullable=True)
+    # Оплачено по эту дату включительно. Только для отчётов: срок действия подписки ведётся по конфигам
+    paid_until: Mapped[date | None] = mapped_column(Date, nullable=True)
+    referrer: Mapped[int] = mapped_column(nullable=True, index=True)
     is_trial: Mapped[bool] = mapped_column(default=True)
     is_active: Mapped[bool] = mapped_column(default=False, nullable=True)
     credits_on_account: Mapped[int] = mapped_column(nullable=False, default=0)
@@ -39,28 +59,111 @@ class User(Base):
 
 class VpnConfig(Base):
     __tablename__ = "vpn_configs"
+    __table_args__ = (
+        # Частичный индекс по свободным конфигам: выдача и подсчёт свободного пула
+        Index('ix_vpn_configs_free', 'id', sqlite_where=text('assigned = 0')),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     file_id: Mapped[str] = mapped_column(String, unique=True)  # ID в Google Drive
     filename: Mapped[str] = mapped_column(String)
     assigned: Mapped[bool] = mapped_column(default=False)
-    expired: Mapped[str] = mapped_column(String(12), nullable=True)  # Дата истечения конфигурации
+    expired: Mapped[date | None] = mapped_column(Date, nullable=True, index=True)  # Дата истечения конфигурации
     device: Mapped[str] = mapped_column(String(30), nullable=True)
-    uid: Mapped[int | None] = mapped_column(ForeignKey("users.uid"), nullable=True)
+    uid: Mapped[int | None] = mapped_column(ForeignKey("users.uid"), nullable=True, index=True)
+    tg_file_id: Mapped[str] = mapped_column(String, nullable=True)  # file_id документа в Telegram
+    disabled: Mapped[bool] = mapped_column(default=False, server_default=false())  # Отключён на сервере wg-easy
 
 
 class TmpInvoice(Base):
     __tablename__ = "tmp_invoices"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    uid: Mapped[int] = mapped_column(ForeignKey("users.uid"))
+    uid: Mapped[int] = mapped_column(ForeignKey("users.uid"), unique=True, index=True)
     config_id: Mapped[int] = mapped_column(ForeignKey("vpn_configs.id"), nullable=True, default=None)
     summary: Mapped[int] = mapped_column(nullable=True)
     use_credits: Mapped[bool] = mapped_column(default=False, nullable=True)
     number_of_configs: Mapped[int] = mapped_column(default=1)
     days_to_increase: Mapped[int] = mapped_column(nullable=True)
+    device: Mapped[str] = mapped_column(String(30), nullable=True)  # Устройство, для которого оформлен заказ
     paid: Mapped[bool] = mapped_column(default=False)
-    paid_at: Mapped[str] = mapped_column(String(12), nullable=True)
-    created_at: Mapped[str] = mapped_column(String(12), nullable=False)
+    paid_at: Mapped[date | None] = mapped_column(Date, nullable=True)
+    created_at: Mapped[date] = mapped_column(Date, nullable=False)
+
+
+class Payment(Base):
+    __tablename__ = "payments"
+
+    charge_id: Mapped[str] = mapped_column(String, primary_key=True)  # telegram_payment_charge_id
+    uid: Mapped[int] = mapped_column(ForeignKey("users.uid"), index=True)
+    amount: Mapped[int] = mapped_column(nullable=False)  # В копейках
+    currency: Mapped[str] = mapped_column(String(3), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class PendingOrder(Base):
+    __tablename__ = "pending_orders"
+
+    # Оплаченный заказ, на который не хватило свободных конфигов: выдаётся, когда они появятся
+    charge_id: Mapped[str] = mapped_column(ForeignKey("payments.charge_id"), primary_key=True)
+    uid: Mapped[int] = mapped_column(ForeignKey("users.uid"), index=True)
+    number_of_configs: Mapped[int] = mapped_column(nullable=False)
+    days: Mapped[int] = mapped_column(nullable=False)
+    device: Mapped[str] = mapped_column(String(30), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class SentNotification(Base):
+    __tablename__ = "sent_notifications"
+
+    # Отметка о рассылке по конфигу за день: после рестарта рассылка продолжается с неотправленных
+    config_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    sent_on: Mapped[date] = mapped_column(Date, primary_key=True)
+
+
+class ScheduledNotification(Base):
+    __tablename__ = "scheduled_notifications"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    uid: Mapped[int] = mapped_column(nullable=False)
+    text: Mapped[str] = mapped_column(String, nullable=False)
+    config_id: Mapped[int] = mapped_column(nullable=True)  # Конфиг для кнопки продления
+    send_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+    attempts: Mapped[int] = mapped_column(default=0, server_default='0')
+
+
+class UserCacheEntry(Base):
+    __tablename__ = "user_cache"
+
+    # Данные незавершённого оформления заказа, чтобы оплата работала после рестарта
+    uid: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    device: Mapped[str] = mapped_column(String(30), nullable=True)
+    phone: Mapped[str] = mapped_column(String(20), nullable=True)
+    email: Mapped[str] = mapped_column(String(150), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
+class FsmRecord(Base):
+    __tablename__ = "fsm_states"
+
+    # Состояние FSM aiogram, общее для всех процессов бота. key - bot_id:chat_id:user_id[:thread_id]:destiny
+    key: Mapped[str] = mapped_column(String(100), primary_key=True)
+    state: Mapped[str] = mapped_column(String(100), nullable=True)
+    data: Mapped[str] = mapped_column(String, nullable=False, default='{}')  # JSON
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
+class MediaFile(Base):
+    __tablename__ = "media_files"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)  # Путь к файлу в проекте или ссылка
+    file_id: Mapped[str] = mapped_column(String, nullable=False)  # file_id, выданный Telegram
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[str] = mapped_column(String, nullable=True)  # Например, отметка синхронизации с Google Drive
 
 
 async def init_db():
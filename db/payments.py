@@ -0,0 +1,150 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import async_session, User, VpnConfig, TmpInvoice, Payment, PendingOrder
+from db.requests import with_session, allocate_vpn_configs
+from utils import logger
+
+REFERRAL_BONUS = 0.25
+
+
+@with_session
+async def fulfill_payment(
+        uid: int,
+        charge_id: str,
+        amount: int,
+        currency: str,
+        credits_left: int,
+        *,
+        session: AsyncSession,
+) -> dict | None:
+    """
+    Применяет оплату целиком в одной транзакции: бонусы, реферальное начисление,
+    дни подписки, выдача новых конфигов или продление оплаченного, удаление инвойса.
+
+    Оплата регистрируется по telegram_payment_charge_id, поэтому повторная обработка
+    того же платежа ничего не меняет и возвращает None. Сообщения пользователю нужно
+    отправлять только после коммита транзакции. Если свободных конфигов не хватило,
+    заказ сохраняется в pending_orders и выдаётся позже (fill_pending_order).
+
+    :param amount: Сумма платежа в копейках.
+    :param credits_left: Остаток бонусов после списания (из payload инвойса).
+    :return: None для повторного платежа, иначе словарь: days, number_of_configs,
+        device, configs (выданные конфиги), renewed (продлённый конфиг), shortage (не хватило
+        свободных конфигов), missing_invoice (инвойс не найден, применить оплату нельзя).
+    """
+    now = datetime.now()
+    conn = await session.connection()
+    result = await conn.execute(
+        sqlite_insert(Payment)
+        .values(
+            charge_id=charge_id,
+            uid=uid,
+            amount=amount,
+            currency=currency,
+            created_at=now,
+        )
+        .on_conflict_do_nothing(index_elements=[Payment.charge_id])
+    )
+    if not result.rowcount:
+        logger.warning(f'Платёж {charge_id} пользователя {uid} уже обработан, повтор пропущен')
+        return None
+
+    user = await session.get(User, uid)
+    invoice = (await session.execute(
+        select(TmpInvoice).where(TmpInvoice.uid == uid)
+    )).scalar_one_or_none()
+    if invoice is None:
+        logger.error(f'Платёж {charge_id} пользователя {uid} получен без инвойса')
+        return {
+            'days': 0,
+            'number_of_configs': 0,
+            'device': None,
+            'configs': [],
+            'renewed': None,
+            'shortage': False,
+            'missing_invoice': True,
+        }
+
+    summ = amount / 100
+    user.credits_on_account = credits_left
+    if user.referrer is not None and user.referrer != 'None':
+        bonus = int(summ * REFERRAL_BONUS)
+        referrer = await session.get(User, user.referrer)
+        if referrer:
+            referrer.credits_on_account += bonus
+        user.credits_on_account += bonus
+        user.referrer = 'None'
+
+    days = invoice.days_to_increase
+    today = now.date()
+    user.pay_date_time = today.strftime('%Y-%m-%d')
+    user.paid_until = max(user.paid_until or today, today) + timedelta(days=days)
+
+    configs = []
+    renewed = None
+    shortage = False
+    if invoice.config_id is None:
+        exp_date = today + timedelta(days=days)
+        configs = await allocate_vpn_configs(uid, invoice.number_of_configs, exp_date, invoice.device,
+                                             session=session)
+        if not configs:
+            shortage = True
+            session.add(PendingOrder(
+                charge_id=charge_id,
+                uid=uid,
+                number_of_configs=invoice.number_of_configs,
+                days=days,
+                device=invoice.device,
+                created_at=now,
+            ))
+    else:
+        config = await session.get(VpnConfig, invoice.config_id)
+        # Как и paid_until: если подписка уже закончилась, дни считаются от сегодня
+        config.expired = max(config.expired or today, today) + timedelta(days=days)
+        renewed = config.as_dict()
+
+    await session.delete(invoice)
+    await session.flush()
+    return {
+        'days': days,
+        'number_of_configs': invoice.number_of_configs,
+        'device': invoice.device,
+        'configs': configs,
+        'renewed': renewed,
+        'shortage': shortage,
+        'missing_invoice': False,
+    }
+
+
+async def get_pending_orders() -> list[dict]:
+    """Оплаченные, но не выданные заказы в порядке оплаты."""
+    async with async_session() as session:
+        result = await session.execute(select(PendingOrder).order_by(PendingOrder.created_at))
+        return [order.as_dict() for order in result.scalars()]
+
+
+@with_session
+async def fill_pending_order(charge_id: str, *, session: AsyncSession) -> dict | None:
+    """
+    Выдаёт конфиги по отложенному заказу и удаляет его.
+
+    Дни подписки считаются от дня выдачи. Если свободных конфигов всё ещё
+    не хватает, ничего не меняется и возвращается None.
+
+    :return: Заказ (словарь PendingOrder) с выданными конфигами в configs.
+    """
+    order = await session.get(PendingOrder, charge_id)
+    if order is None:
+        return None
+    exp_date = date.today() + timedelta(days=order.days)
+    configs = await allocate_vpn_configs(order.uid, order.number_of_configs, exp_date, order.device,
+                                         session=session)
+    if not configs:
+        return None
+    await session.delete(order)
+    await session.flush()
+    return {**order.as_dict(), 'configs': configs}
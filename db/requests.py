@@ -1,50 +1,100 @@
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime, timedelta
+from contextvars import ContextVar
+from functools import wraps
+from typing import AsyncIterator, Optional
 
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, exists, false, func, cast, Integer, and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import async_session, User, VpnConfig, TmpInvoice
+from db.inventory import config_pool
+from db.models import (async_session, User, VpnConfig, TmpInvoice, MediaFile, SyncState, SentNotification,
+                       ScheduledNotification, UserCacheEntry, FsmRecord)
 from utils import logger
 
 
+# Идёт ли сейчас запрос, обёрнутый with_session (вложенные запросы не коммитят сами)
+_in_request: ContextVar[bool] = ContextVar('_in_request', default=False)
+
+
+def with_session(func):
+    """
+    Позволяет передать в запрос сессию обработчика (session=...), чтобы апдейт
+    обходился одним соединением из пула.
+
+    Коммит при этом не один на апдейт, а после каждого запроса, который что-то
+    изменил: SQLite держит единственную блокировку записи до коммита, а обработчик
+    между запросами к БД ждёт Telegram, и с одним коммитом в конце блокировка
+    держалась бы на всё это время, останавливая запись в остальных апдейтах.
+    Читающие запросы транзакцию записи не открывают, их коммит ничего не пишет.
+    При ошибке откатываются только изменения этого запроса. Запрос, вызванный
+    из другого такого запроса, выполняется в его транзакции.
+    Без сессии открывается своя сессия с коммитом в конце.
+    """
+    @wraps(func)
+    async def wrapper(*args, session: AsyncSession | None = None, **kwargs):
+        if session is not None and _in_request.get():
+            return await func(*args, session=session, **kwargs)
+        token = _in_request.set(True)
+        try:
+            if session is not None:
+                try:
+                    result = await func(*args, session=session, **kwargs)
+                except Exception:
+                    await session.rollback()
+                    raise
+                await session.commit()
+                return result
+            async with async_session() as session:
+                result = await func(*args, session=session, **kwargs)
+                await session.commit()
+                return result
+        finally:
+            _in_request.reset(token)
+    return wrapper
+
+
+@with_session
 async def create_user(
         uid: int,
         username: str,
         pay_date_time: str | None = None,
-        subscribe_days_left: int = 0,
         ref_id: int | None = None,
         is_trial: bool = True,
         is_active: bool = False,
+        *,
+        session: AsyncSession,
 ):
-    async with async_session() as session:
-        current_user = await session.get(User, uid)
-        if current_user:
-            if ref_id and current_user.referrer is None:
-                current_user.referrer = ref_id
-                await session.commit()
-                return current_user
-            elif current_user.referrer is not None:
-                return
+    current_user = await session.get(User, uid)
+    if current_user:
+        if ref_id and current_user.referrer is None:
+            current_user.referrer = ref_id
+            await session.flush()
+            return current_user
+        elif current_user.referrer is not None:
             return
-
-        user = User(
-            uid=uid,
-            username=username,
-            pay_date_time=pay_date_time,
-            subscribe_days_left=subscribe_days_left,
-            referrer=ref_id,
-            is_trial=is_trial,
-            is_active=is_active,
-            credits_on_account=0,
-        )
-        session.add(user)
-        await session.commit()
-        return user
-
-
+        return
+
+    user = User(
+        uid=uid,
+        username=username,
+        pay_date_time=pay_date_time,
+        referrer=ref_id,
+        is_trial=is_trial,
+        is_active=is_active,
+        credits_on_account=0,
+    )
+    session.add(user)
+    await session.flush()
+    return user
+
+
+@with_session
 async def update_user(
         uid: int,
+        *,
+        session: AsyncSession,
         **kwargs
 ) -> Optional[dict]:
     allowed_fields = {
@@ -52,7 +102,7 @@ async def update_user(
         "phone_number",
         "email",
         "pay_date_time",
-        "subscribe_days_left",
+        "paid_until",
         "referrer",
         "is_referrer",
         "is_trial",
@@ -60,210 +110,570 @@ async def update_user(
         "credits_on_account",
     }
 
-    async with async_session() as session:
-        user = await session.get(User, uid)
-        if not user:
-            return None
+    user = await session.get(User, uid)
+    if not user:
+        return None
 
-        for key, value in kwargs.items():
-            if key in allowed_fields:
-                setattr(user, key, value)
+    for key, value in kwargs.items():
+        if key in allowed_fields:
+            setattr(user, key, value)
 
-        await session.commit()
-        return user.as_dict()
+    await session.flush()
+    return user.as_dict()
 
 
-async def decrease_all_subscriptions():
-    async with async_session() as session:
-        try:
-            stmt = (
-                update(User)
-                .where(User.subscribe_days_left > 0)
-                .values(subscribe_days_left=User.subscribe_days_left - 1)
-            )
-            await session.execute(stmt)
-            await session.commit()
-            logger.info(f"[{datetime.now()}] Уменьшены дни подписки у пользователей")
-        except Exception as e:
-            await session.rollback()
-            logger.error(f"[{datetime.now()}] Ошибка при обновлении дней подписки: {e}")
+CHUNK_SIZE = 500  # Ограничение на число параметров в одном запросе SQLite
+
 
+async def _select_known_file_ids(session: AsyncSession, file_ids: list[str]) -> set[str]:
+    known = set()
+    for i in range(0, len(file_ids), CHUNK_SIZE):
+        result = await session.execute(
+            select(VpnConfig.file_id).where(VpnConfig.file_id.in_(file_ids[i:i + CHUNK_SIZE]))
+        )
+        known.update(result.scalars())
+    return known
 
-async def update_configs(paths: list[tuple[str, str]]):
+
+async def update_configs(paths: list[tuple[str, str]]) -> tuple[int, int]:
+    """
+    Добавляет конфиги пачкой, пропуская уже известные ID Google Drive.
+
+    :param paths: Пары (путь к файлу, ID в Google Drive).
+    :return: Количество добавленных и пропущенных конфигов.
+    :raises SQLAlchemyError: Если вставить конфиги не удалось.
+    """
+    if not paths:
+        return 0, 0
     async with async_session() as session:
         try:
-            for file_path, file_id in paths:
-                filename = file_path  # Имя файла из пути
-                result = await session.execute(
-                    select(VpnConfig).where(VpnConfig.file_id == file_id)
+            known = await _select_known_file_ids(session, [file_id for _, file_id in paths])
+            rows = list({
+                file_id: {'file_id': file_id, 'filename': file_path, 'assigned': False, 'uid': None}
+                for file_path, file_id in paths
+                if file_id not in known
+            }.values())
+            inserted = 0
+            if rows:
+                # ON CONFLICT DO NOTHING страхует от конфигов, добавленных параллельно после SELECT
+                conn = await session.connection()
+                result = await conn.execute(
+                    sqlite_insert(VpnConfig).on_conflict_do_nothing(index_elements=[VpnConfig.file_id]),
+                    rows
                 )
-                existing = result.scalar_one_or_none()
-                if existing:
-                    logger.info(f"Файл {filename} (ID: {file_id}) уже существует в БД, пропуск...")
-                    continue
-                new_config = VpnConfig(
-                    file_id=file_id,
-                    filename=filename,
-                    assigned=False,
-                    uid=None
-                )
-                session.add(new_config)
-                logger.info(f"Добавлен конфиг {filename} в БД")
+                inserted = result.rowcount
             await session.commit()
+            config_pool.add(inserted)
+            skipped = len(paths) - inserted
+            logger.info(f"Добавлено конфигов в БД: {inserted}, пропущено: {skipped}")
+            return inserted, skipped
         except SQLAlchemyError as e:
             await session.rollback()
             logger.error(f"Ошибка при обновлении конфигов в БД: {e}")
+            raise
 
 
-async def get_user_data(uid):
+async def get_known_config_file_ids(file_ids: list[str]) -> set[str]:
+    """Возвращает те ID Google Drive из переданных, которые уже есть в БД."""
     async with async_session() as session:
-        me = await session.get(User, uid)
-        return me.as_dict()
+        return await _select_known_file_ids(session, file_ids)
 
 
-async def get_all_users() -> list[dict]:
-    async with async_session() as session:
-        users = await session.execute(select(User))
-        return [user.as_dict() for user in users.scalars()]
+@with_session
+async def get_user_data(uid, *, session: AsyncSession):
+    me = await session.get(User, uid)
+    return me.as_dict()
 
 
-async def get_all_configs() -> list[dict] | None:
-    async with async_session() as session:
-        result = await session.execute(select(VpnConfig))
-        configs = [conf.as_dict() for conf in result.scalars()]
-        return configs or None
+@with_session
+async def get_all_users(*, session: AsyncSession) -> list[dict]:
+    users = await session.execute(select(User))
+    return [user.as_dict() for user in users.scalars()]
 
 
-async def get_config_by_id(config_id):
-    async with async_session() as session:
-        config = await session.get(VpnConfig, config_id)
-        return config.as_dict() if config else None
+@with_session
+async def get_all_configs(*, session: AsyncSession) -> list[dict] | None:
+    result = await session.execute(select(VpnConfig))
+    configs = [conf.as_dict() for conf in result.scalars()]
+    return configs or None
+
+
+@with_session
+async def get_config_by_id(config_id, *, session: AsyncSession):
+    config = await session.get(VpnConfig, config_id)
+    return config.as_dict() if config else None
+
+
+@with_session
+async def allocate_vpn_configs(
+        uid: int,
+        count: int,
+        exp_date: date,
+        device: str,
+        *,
+        session: AsyncSession,
+) -> list[dict]:
+    """
+    Атомарно выдаёт пользователю count свободных конфигов одним UPDATE ... RETURNING.
+
+    Если свободных конфигов меньше, чем нужно, ничего не выдаётся и возвращается пустой список.
+    """
+    free_ids = (
+        select(VpnConfig.id)
+        # "= 0", а не "IS 0": иначе SQLite не использует частичный индекс ix_vpn_configs_free
+        .where(VpnConfig.assigned == false())
+        .order_by(VpnConfig.id)
+        .limit(count)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(VpnConfig)
+        .where(VpnConfig.id.in_(free_ids))
+        .values(
+            assigned=True,
+            uid=uid,
+            expired=exp_date,
+            device=device
+        )
+        .returning(VpnConfig)
+        .execution_options(synchronize_session=False)
+    )
+    configs = [config.as_dict() for config in result.scalars()]
+    if len(configs) < count:
+        # Сессия может быть общей с обработчиком, поэтому вместо rollback возвращаем конфиги обратно
+        await session.execute(
+            update(VpnConfig)
+            .where(VpnConfig.id.in_([config['id'] for config in configs]))
+            .values(assigned=False, uid=None, expired=None, device=None)
+            .execution_options(synchronize_session=False)
+        )
+        logger.error(f"Недостаточно свободных конфигов для {uid}: нужно {count}, есть {len(configs)}")
+        return []
+    await session.flush()
+    config_pool.take(len(configs))
+    return configs
 
 
 async def get_free_vpn_config(
         uid: int,
-        exp_date: str,
+        exp_date: date,
         device: str,
+        session: AsyncSession | None = None,
 ) -> dict | None:
-    # Получаем первый свободный конфиг
+    configs = await allocate_vpn_configs(uid, 1, exp_date, device, session=session)
+    return configs[0] if configs else None
+
+
+@with_session
+async def update_exp_date(
+        config_id: int,
+        new_date: date,
+        *,
+        session: AsyncSession,
+) -> dict | None:
+    config = await session.get(VpnConfig, config_id)
+    logger.info(f'{config.as_dict()}')
+    if config:
+        config.expired = new_date
+        await session.flush()
+        return config.as_dict()
+    return None
+
+
+@with_session
+async def update_config_tg_file_id(
+        config_id: int,
+        tg_file_id: str | None,
+        *,
+        session: AsyncSession,
+):
+    await session.execute(
+        update(VpnConfig)
+        .where(VpnConfig.id == config_id)
+        .values(tg_file_id=tg_file_id)
+    )
+    await session.flush()
+
+
+async def get_configs_to_disable(today: date) -> list[dict]:
+    """Выданные конфиги с истёкшей подпиской, которые ещё не отключены на сервере."""
+    async with async_session() as session:
+        result = await session.execute(
+            select(VpnConfig).where(
+                VpnConfig.assigned.is_(True),
+                VpnConfig.disabled.is_(False),
+                VpnConfig.expired < today,
+            )
+        )
+        return [conf.as_dict() for conf in result.scalars()]
+
+
+async def get_configs_to_enable(today: date) -> list[dict]:
+    """Отключённые конфиги, подписка которых снова действует (например, после продления)."""
     async with async_session() as session:
         result = await session.execute(
-            select(VpnConfig).where(VpnConfig.assigned.is_(False)).limit(1)
+            select(VpnConfig).where(
+                VpnConfig.disabled.is_(True),
+                VpnConfig.expired >= today,
+            )
         )
-        config = result.scalar_one_or_none()
-
-        if config:
-            # Помечаем как выданный
-            await session.execute(
-                update(VpnConfig)
-                .where(VpnConfig.id == config.id)
-                .values(
-                    assigned=True,
-                    uid=uid,
-                    expired=exp_date,
-                    device=device
+        return [conf.as_dict() for conf in result.scalars()]
+
+
+EXPIRY_BATCH_SIZE = 500
+
+
+async def iter_expiring_configs(
+        today: date,
+        days_before: int = 3,
+        batch_size: int = EXPIRY_BATCH_SIZE,
+) -> AsyncIterator[list[dict]]:
+    """
+    Конфиги для уведомлений об окончании подписки пачками по batch_size.
+
+    В выборку попадают истёкшие конфиги, о которых ещё не сообщали после истечения
+    (поэтому пропущенный день рассылки наверстывается), и те, у которых осталось
+    не больше days_before дней. Вместе с конфигом сразу выбираются данные
+    пользователя, а days_left считается в SQL.
+    """
+    date_to = today + timedelta(days=days_before)
+    notified_expired = exists().where(
+        SentNotification.config_id == VpnConfig.id,
+        SentNotification.sent_on > VpnConfig.expired,
+    )
+    days_left = cast(
+        func.julianday(VpnConfig.expired) - func.julianday(today), Integer
+    ).label('days_left')
+    last_id = 0
+    while True:
+        # Каждая пачка читается отдельной короткой транзакцией, чтобы не держать
+        # соединение, пока рассылаются уведомления
+        async with async_session() as session:
+            result = await session.execute(
+                select(
+                    VpnConfig.id,
+                    VpnConfig.uid,
+                    VpnConfig.device,
+                    VpnConfig.filename,
+                    VpnConfig.file_id,
+                    User.username,
+                    User.phone_number,
+                    days_left,
+                )
+                .join(User, User.uid == VpnConfig.uid)
+                .where(
+                    or_(
+                        VpnConfig.expired.between(today, date_to),
+                        and_(VpnConfig.expired < today, ~notified_expired),
+                    ),
+                    VpnConfig.id > last_id,
                 )
+                .order_by(VpnConfig.id)
+                .limit(batch_size)
             )
-            await session.commit()
-            return config.as_dict()
-        return None
+            batch = [dict(row) for row in result.mappings()]
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1]['id']
 
 
-async def update_exp_date(
-        config_id: int,
-        new_date: str,
-) -> dict | None:
+async def get_notified_config_ids(config_ids: list[int], sent_on: date) -> set[int]:
+    """Конфиги из переданных, по которым уведомление за день sent_on уже отправлено."""
     async with async_session() as session:
-        config = await session.get(VpnConfig, config_id)
-        logger.info(f'{config.as_dict()}')
-        if config:
-            config.expired = new_date
-            await session.commit()
-            return config.as_dict()
-        return None
+        result = await session.execute(
+            select(SentNotification.config_id).where(
+                SentNotification.sent_on == sent_on,
+                SentNotification.config_id.in_(config_ids),
+            )
+        )
+        return set(result.scalars())
+
+
+async def mark_configs_notified(config_ids: list[int], sent_on: date):
+    if not config_ids:
+        return
+    async with async_session() as session:
+        conn = await session.connection()
+        await conn.execute(
+            sqlite_insert(SentNotification).on_conflict_do_nothing(),
+            [{'config_id': config_id, 'sent_on': sent_on} for config_id in config_ids]
+        )
+        await session.commit()
+
+
+async def delete_sent_notifications_before(sent_on: date):
+    """
+    Удаляет старые отметки о рассылке. Отметку об истечении не продлённого с тех пор
+    конфига оставляем: по ней iter_expiring_configs не сообщает об истечении повторно.
+    """
+    still_expired = exists().where(
+        VpnConfig.id == SentNotification.config_id,
+        VpnConfig.expired < SentNotification.sent_on,
+    )
+    async with async_session() as session:
+        await session.execute(
+            delete(SentNotification).where(SentNotification.sent_on < sent_on, ~still_expired)
+        )
+        await session.commit()
 
 
-async def get_user_devices(uid) -> list[VpnConfig]:
+async def schedule_notifications(notifications: list[dict]):
+    """Добавляет отложенные сообщения: словари с uid, text, send_at и необязательным config_id."""
+    if not notifications:
+        return
     async with async_session() as session:
-        user_devices = await session.execute(
-            select(VpnConfig).where(VpnConfig.uid == uid)
+        conn = await session.connection()
+        await conn.execute(
+            ScheduledNotification.__table__.insert(),
+            [{'config_id': None, **notification} for notification in notifications]
         )
-        return user_devices.scalars().all()
+        await session.commit()
 
 
+async def get_due_notifications(now: datetime, limit: int) -> list[dict]:
+    """Отложенные сообщения, время отправки которых наступило, в порядке очереди."""
+    async with async_session() as session:
+        result = await session.execute(
+            select(ScheduledNotification)
+            .where(ScheduledNotification.send_at <= now)
+            .order_by(ScheduledNotification.send_at, ScheduledNotification.id)
+            .limit(limit)
+        )
+        return [notification.as_dict() for notification in result.scalars()]
+
+
+async def delete_scheduled_notifications(ids: list[int]):
+    if not ids:
+        return
+    async with async_session() as session:
+        await session.execute(delete(ScheduledNotification).where(ScheduledNotification.id.in_(ids)))
+        await session.commit()
+
+
+async def postpone_scheduled_notifications(ids: list[int], send_at: datetime):
+    """Переносит неотправленные сообщения на send_at и увеличивает счётчик попыток."""
+    if not ids:
+        return
+    async with async_session() as session:
+        await session.execute(
+            update(ScheduledNotification)
+            .where(ScheduledNotification.id.in_(ids))
+            .values(send_at=send_at, attempts=ScheduledNotification.attempts + 1)
+        )
+        await session.commit()
+
+
+@with_session
+async def set_configs_disabled(config_ids: list[int], disabled: bool, *, session: AsyncSession):
+    if not config_ids:
+        return
+    await session.execute(
+        update(VpnConfig)
+        .where(VpnConfig.id.in_(config_ids))
+        .values(disabled=disabled)
+    )
+    await session.flush()
+
+
+@with_session
+async def get_user_devices(uid, *, session: AsyncSession) -> list[VpnConfig]:
+    user_devices = await session.execute(
+        select(VpnConfig).where(VpnConfig.uid == uid)
+    )
+    return user_devices.scalars().all()
+
+
+@with_session
 async def reg_invoice(
         uid: int,
         summary: int = None,
         days_to_increase: int = None,
         config_id: Optional[int] = None,
         number_of_configs: int = 1,
+        device: str | None = None,
+        *,
+        session: AsyncSession,
 ) -> dict | None:
-    async with async_session() as session:
-        try:
-            # Проверяем существование конфига, если передан config_id
-            if config_id is not None:
-                config = await session.get(VpnConfig, config_id)
-                if not config:
-                    return None
-
-            # Создаем новую временную инвойс-запись
-            new_invoice = TmpInvoice(
-                uid=uid,
-                config_id=config_id,
-                summary=summary,
-                days_to_increase=days_to_increase,
-                number_of_configs=number_of_configs,
-                paid=False,
-                paid_at=None,
-                created_at=datetime.now().strftime('%Y-%m-%d')
-            )
+    try:
+        # Проверяем существование конфига, если передан config_id
+        if config_id is not None:
+            config = await session.get(VpnConfig, config_id)
+            if not config:
+                return None
+
+        # У пользователя может быть только один незавершённый инвойс - новый заменяет старый
+        await session.execute(delete(TmpInvoice).where(TmpInvoice.uid == uid))
+
+        # Создаем новую временную инвойс-запись
+        new_invoice = TmpInvoice(
+            uid=uid,
+            config_id=config_id,
+            summary=summary,
+            days_to_increase=days_to_increase,
+            number_of_configs=number_of_configs,
+            device=device,
+            paid=False,
+            paid_at=None,
+            created_at=date.today()
+        )
 
-            # Добавляем в сессию и коммитим
-            session.add(new_invoice)
-            await session.commit()
-            await session.refresh(new_invoice)
+        # Добавляем в сессию и коммитим
+        session.add(new_invoice)
+        await session.flush()
+        await session.refresh(new_invoice)
 
-            # Возвращаем данные инвойса в виде словаря
-            return new_invoice.as_dict()
+        # Возвращаем данные инвойса в виде словаря
+        return new_invoice.as_dict()
 
-        except SQLAlchemyError as e:
-            await session.rollback()
-            logger.error(f"Ошибка при создании временного инвойса: {str(e)}")
-            return None
+    except SQLAlchemyError as e:
+        # Откат делает with_session: сессия может быть общей с обработчиком
+        logger.error(f"Ошибка при создании временного инвойса: {str(e)}")
+        raise
 
 
-async def get_invoice_by_uid(uid: int) -> Optional[dict]:
-    async with async_session() as session:
-        result = await session.execute(
-            select(TmpInvoice).where(TmpInvoice.uid == uid)
-        )
-        invoice = result.scalar_one_or_none()
-        return invoice.as_dict() if invoice else None
+@with_session
+async def get_invoice_by_uid(uid: int, *, session: AsyncSession) -> Optional[dict]:
+    result = await session.execute(
+        select(TmpInvoice).where(TmpInvoice.uid == uid)
+    )
+    invoice = result.scalar_one_or_none()
+    return invoice.as_dict() if invoice else None
 
 
+@with_session
 async def update_invoice(
         uid: int,
+        *,
+        session: AsyncSession,
         **kwargs
 ) -> Optional[dict]:
+    result = await session.execute(
+        select(TmpInvoice).where(TmpInvoice.uid == uid)
+    )
+    invoice = result.scalar_one_or_none()
+    if not invoice:
+        return None
+
+    for key, value in kwargs.items():
+        setattr(invoice, key, value)
+
+    await session.flush()
+    return invoice.as_dict()
+
+
+@with_session
+async def delete_invoice(uid: int, *, session: AsyncSession) -> bool:
+    result = await session.execute(
+        delete(TmpInvoice).where(TmpInvoice.uid == uid)
+    )
+    await session.flush()
+    return result.rowcount > 0
+
+
+async def get_media_file_ids() -> dict[str, str]:
     async with async_session() as session:
-        result = await session.execute(
-            select(TmpInvoice).where(TmpInvoice.uid == uid)
-        )
-        invoice = result.scalar_one_or_none()
-        if not invoice:
-            return None
+        result = await session.execute(select(MediaFile))
+        return {media.key: media.file_id for media in result.scalars()}
+
+
+@with_session
+async def save_media_file_id(key: str, file_id: str, *, session: AsyncSession):
+    await session.merge(MediaFile(key=key, file_id=file_id))
+    await session.flush()
+
+
+async def get_sync_value(key: str) -> str | None:
+    async with async_session() as session:
+        state = await session.get(SyncState, key)
+        return state.value if state else None
+
+
+async def set_sync_value(key: str, value: str | None):
+    async with async_session() as session:
+        await session.merge(SyncState(key=key, value=value))
+        await session.commit()
 
-        for key, value in kwargs.items():
-            setattr(invoice, key, value)
 
+@with_session
+async def get_user_cache(uid: int, *, session: AsyncSession) -> dict | None:
+    entry = await session.get(UserCacheEntry, uid)
+    return entry.as_dict() if entry else None
+
+
+@with_session
+async def save_user_cache(
+        uid: int,
+        device: str | None,
+        phone: str | None,
+        email: str | None,
+        *,
+        session: AsyncSession,
+) -> datetime:
+    """Сохраняет данные заказа и возвращает время сохранения (updated_at)."""
+    updated_at = datetime.now()
+    await session.merge(UserCacheEntry(
+        uid=uid,
+        device=device,
+        phone=phone,
+        email=email,
+        updated_at=updated_at,
+    ))
+    await session.flush()
+    return updated_at
+
+
+async def delete_user_cache_before(updated_at: datetime):
+    async with async_session() as session:
+        await session.execute(delete(UserCacheEntry).where(UserCacheEntry.updated_at < updated_at))
         await session.commit()
-        return invoice.as_dict()
 
 
-async def delete_invoice(uid: int) -> bool:
+async def get_fsm_record(key: str) -> dict | None:
     async with async_session() as session:
-        result = await session.execute(
-            delete(TmpInvoice).where(TmpInvoice.uid == uid)
-        )
+        record = await session.get(FsmRecord, key)
+        return record.as_dict() if record else None
+
+
+async def save_fsm_records(records: list[dict], deleted_keys: list[str]):
+    """Одной транзакцией сохраняет пачку состояний FSM (upsert) и удаляет сброшенные."""
+    if not records and not deleted_keys:
+        return
+    async with async_session() as session:
+        conn = await session.connection()
+        if records:
+            stmt = sqlite_insert(FsmRecord)
+            await conn.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[FsmRecord.key],
+                    set_={
+                        'state': stmt.excluded.state,
+                        'data': stmt.excluded.data,
+                        'updated_at': stmt.excluded.updated_at,
+                    },
+                ),
+                records
+            )
+        if deleted_keys:
+            await conn.execute(delete(FsmRecord).where(FsmRecord.key.in_(deleted_keys)))
+        await session.commit()
+
+
+async def touch_fsm_records(keys: list[str], updated_at: datetime):
+    """Отмечает активность пользователей: переносит updated_at у существующих состояний."""
+    if not keys:
+        return
+    async with async_session() as session:
+        conn = await session.connection()
+        await conn.execute(update(FsmRecord).where(FsmRecord.key.in_(keys)).values(updated_at=updated_at))
+        await session.commit()
+
+
+async def delete_fsm_records_before(updated_at: datetime) -> int:
+    async with async_session() as session:
+        conn = await session.connection()
+        result = await conn.execute(delete(FsmRecord).where(FsmRecord.updated_at < updated_at))
         await session.commit()
-        return result.rowcount > 0
\ No newline at end of file
+        return result.rowcount
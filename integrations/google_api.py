@@ -2,16 +2,23 @@ import asyncio
 import io
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
 
 import gspread
+import httplib2
 from aiogram import Bot
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 from gspread import SpreadsheetNotFound
 from oauth2client.service_account import ServiceAccountCredentials
 from googleapiclient.discovery import build
 
 import db
-from utils import logger
+from utils import logger, TokenBucket
 from config import Config, BASE_DIR
 
 
@@ -25,27 +32,65 @@ SCOPES = [
 creds_info = Config.GOOGLE_CREDENTIALS_JSON
 creds = ServiceAccountCredentials.from_json_keyfile_name(Config.GOOGLE_CREDENTIALS_JSON, SCOPES)
 client = gspread.authorize(creds)
+client.http_client.set_timeout(Config.GOOGLE_API_TIMEOUT)
 bot = Bot(token=Config.BOT_TOKEN)
 
-drive_service = build('drive', 'v3', credentials=creds)
+T = TypeVar('T')
+
+# gspread и googleapiclient блокирующие, поэтому все вызовы уходят в отдельный пул потоков,
+# чтобы не останавливать обработку апдейтов Telegram
+_executor = ThreadPoolExecutor(max_workers=Config.GOOGLE_API_WORKERS, thread_name_prefix='google_api')
+_semaphore = asyncio.Semaphore(Config.GOOGLE_API_WORKERS)
+_local = threading.local()
+
+
+def _drive_service():
+    # httplib2.Http не потокобезопасен, поэтому у каждого потока свой клиент Drive
+    if not hasattr(_local, 'drive_service'):
+        http = creds.authorize(httplib2.Http(timeout=Config.GOOGLE_API_TIMEOUT))
+        _local.drive_service = build('drive', 'v3', http=http, cache_discovery=False)
+    return _local.drive_service
+
+
+async def run_blocking(func: Callable[..., T], *args, timeout: float = Config.GOOGLE_API_TIMEOUT, **kwargs) -> T:
+    """
+    Выполняет блокирующий вызов Google API в пуле потоков.
+
+    Одновременно выполняется не больше GOOGLE_API_WORKERS вызовов, каждый ограничен
+    timeout секундами. При превышении таймаута выбрасывается asyncio.TimeoutError.
+    """
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(
+            loop.run_in_executor(_executor, partial(func, *args, **kwargs)),
+            timeout
+        )
+
+
+def _append_row(info: list):
+    sheet = client.open_by_key(SHEET_ID).sheet1
+    return sheet.append_row(info)
 
 
 async def send_info(info: list):
     try:
         logger.info('Called send_info')
-        sheet = client.open_by_key(SHEET_ID).sheet1
-        result = sheet.append_row(info)
+        result = await run_blocking(_append_row, info)
         logger.info(f'Результат отправки данных в таблицу: {result}')
         return result
     except SpreadsheetNotFound:
         logger.error('Таблица не найдена')
 
 
-async def get_instructions():
+def _read_sheet() -> list[list[str]]:
+    sheet = client.open_by_key(SHEET_ID).sheet1
+    return sheet.get_all_values()
+
+
+async def fetch_instructions():
     logger.info('fetching info from google sheet')
     try:
-        sheet = client.open_by_key(SHEET_ID).sheet1
-        data = sheet.get_all_values()
+        data = await run_blocking(_read_sheet)
         rows = data[1:]  # Skip the header row
         logger.info('Data read successfully')
     except SpreadsheetNotFound:
@@ -61,9 +106,101 @@ async def get_instructions():
     return msg_dict
 
 
-def download_file_from_drive(file_id: str, filename: str, dest_folder: str = "vpn_configs") -> str:
+class InstructionsCache:
+    """
+    Кеш инструкций из Google Sheets по схеме stale-while-revalidate.
+
+    Пока данные свежее ttl, они отдаются без обращения к таблице. Устаревшие данные
+    отдаются сразу, а обновление запускается в фоне. Если таблица недоступна,
+    продолжаем отдавать последнюю удачно загруженную копию.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._data: dict[str, list] = {}
+        self._fetched_at: float | None = None
+        self._refresh_task: asyncio.Task | None = None
+
+    def _is_stale(self) -> bool:
+        return self._fetched_at is None or time.monotonic() - self._fetched_at > self.ttl
+
+    async def _fetch(self):
+        try:
+            data = await fetch_instructions()
+        except Exception as e:
+            logger.error(f'Не удалось обновить инструкции, используется сохранённая копия: {e}')
+            return
+        if data is not None:
+            self._data = data
+            self._fetched_at = time.monotonic()
+
+    def refresh(self) -> asyncio.Task:
+        """Запускает обновление, если оно ещё не идёт, и возвращает задачу обновления."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return self._refresh_task
+
+    async def get(self) -> dict[str, list]:
+        if self._fetched_at is None:
+            # Копии ещё нет - ждём первой загрузки
+            await asyncio.shield(self.refresh())
+        elif self._is_stale():
+            self.refresh()
+        return self._data
+
+    async def get_device(self, device: str) -> list | None:
+        return (await self.get()).get(device)
+
+
+instructions_cache = InstructionsCache(Config.INSTRUCTIONS_TTL)
+
+
+async def get_instructions() -> dict[str, list]:
+    """Инструкции в виде {заголовок: [текст, ссылка на фото]}."""
+    return await instructions_cache.get()
+
+
+async def get_device_instruction(device: str) -> list | None:
+    """Инструкция для конкретного устройства в виде [текст, ссылка на фото]."""
+    return await instructions_cache.get_device(device)
+
+
+DRIVE_MAX_RETRIES = 5
+DRIVE_PAGE_SIZE = 1000
+DRIVE_WATERMARK_KEY = 'drive_configs_modified_time'
+
+drive_limiter = TokenBucket(Config.DRIVE_RATE_LIMIT)
+_download_lock = asyncio.Lock()
+
+
+def _is_rate_limited(e: HttpError) -> bool:
+    status = e.resp.status
+    return status == 429 or (status == 403 and 'rate' in str(e).lower())
+
+
+async def _drive_call(func: Callable[..., T], *args) -> T:
+    """Вызов Drive API через общий ограничитель частоты с повторами при 429/403."""
+    delay = 1
+    for attempt in range(1, DRIVE_MAX_RETRIES + 1):
+        await drive_limiter.acquire()
+        try:
+            result = await run_blocking(func, *args)
+        except HttpError as e:
+            if not _is_rate_limited(e) or attempt == DRIVE_MAX_RETRIES:
+                raise
+            drive_limiter.back_off()
+            logger.warning(f'Drive ограничил частоту запросов, скорость снижена до '
+                           f'{drive_limiter.rate:.1f}/с, повтор через {delay} с')
+            await asyncio.sleep(delay)
+            delay *= 2
+        else:
+            drive_limiter.recover()
+            return result
+
+
+def _download_file_from_drive(file_id: str, filename: str, dest_folder: str = "vpn_configs") -> str:
     os.makedirs(dest_folder, exist_ok=True)
-    request = drive_service.files().get_media(fileId=file_id)
+    request = _drive_service().files().get_media(fileId=file_id)
 
     file_path = os.path.join(dest_folder, filename)
     with io.FileIO(file_path, 'wb') as fh:
@@ -75,30 +212,102 @@ def download_file_from_drive(file_id: str, filename: str, dest_folder: str = "vp
     return file_path
 
 
-def list_vpn_configs(folder_id: str = FOLDER_ID):
+async def download_file_from_drive(file_id: str, filename: str, dest_folder: str = "vpn_configs") -> str:
+    return await _drive_call(_download_file_from_drive, file_id, filename, dest_folder)
+
+
+def _list_configs_page(folder_id: str, modified_after: str | None, page_token: str | None) -> dict:
     query = f"'{folder_id}' in parents and trashed = false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-    files = results.get("files", [])
+    if modified_after:
+        # >= а не >, чтобы не потерять файлы с тем же временем изменения; повторы отсеиваются по БД
+        query += f" and modifiedTime >= '{modified_after}'"
+    return _drive_service().files().list(
+        q=query,
+        fields="nextPageToken, files(id, name, modifiedTime)",
+        orderBy="modifiedTime",
+        pageSize=DRIVE_PAGE_SIZE,
+        pageToken=page_token,
+    ).execute()
+
+
+async def list_vpn_configs(folder_id: str = FOLDER_ID, modified_after: str | None = None) -> list[dict]:
+    """
+    Список .conf файлов в папке (все страницы выдачи).
+
+    :param modified_after: Время в формате RFC 3339; если передано, вернутся только файлы,
+        изменённые не раньше него.
+    """
+    files = []
+    page_token = None
+    while True:
+        results = await _drive_call(_list_configs_page, folder_id, modified_after, page_token)
+        files.extend(results.get("files", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
     return [f for f in files if f["name"].endswith(".conf")]
 
 
-async def download_configs():
-    config_list = list_vpn_configs()
+async def _download_configs():
+    watermark = await db.get_sync_value(DRIVE_WATERMARK_KEY)
+    config_list = await list_vpn_configs(modified_after=watermark)
     folder_path = os.path.join(BASE_DIR, "vpn_configs")
     os.makedirs(folder_path, exist_ok=True)
-    existing_files = set(os.listdir(folder_path))  # Список уже загруженных файлов
+    known_ids = await db.get_known_config_file_ids([config['id'] for config in config_list])
+    new_configs = [config for config in config_list if config['id'] not in known_ids]
+    total = len(new_configs)
+    if not total:
+        logger.info('Новых конфигов на Google Диске нет')
+        if config_list:
+            await db.set_sync_value(DRIVE_WATERMARK_KEY, config_list[-1]['modifiedTime'])
+        return
+    logger.info(f'Найдено {total} новых конфигов, загрузка в {Config.DRIVE_DOWNLOAD_WORKERS} потоков')
+
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    for config in new_configs:
+        queue.put_nowait(config)
     paths = []
+    failed = []
+    started = time.monotonic()
+    report_every = max(1, total // 10)
 
-    for config in config_list:
-        if config['name'] in existing_files:
-            logger.info(f'{config["name"]} уже существует, пропуск...')
-            continue
+    async def worker():
+        while not queue.empty():
+            config = queue.get_nowait()
+            try:
+                file_path = await download_file_from_drive(config['id'], config['name'], folder_path)
+                paths.append((file_path, config['id']))
+            except Exception as e:
+                failed.append(config)
+                logger.error(f'Не удалось загрузить {config["name"]}: {e}')
+                partial_path = os.path.join(folder_path, config['name'])
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            done = len(paths) + len(failed)
+            if done % report_every == 0 or done == total:
+                logger.info(f'Загрузка конфигов: {done}/{total}, ошибок {len(failed)}, '
+                            f'{time.monotonic() - started:.1f} с')
 
-        file_path = download_file_from_drive(config['id'], config['name'], folder_path)
-        await asyncio.sleep(1.5)
-        paths.append((file_path, config['id']))
+    await asyncio.gather(*(worker() for _ in range(min(Config.DRIVE_DOWNLOAD_WORKERS, total))))
+    # При ошибке БД исключение прерывает синхронизацию до сдвига отметки, и файлы загрузятся заново
     await db.update_configs(paths)
 
+    # Отметку сдвигаем только до первого незагруженного файла, чтобы повторить его в следующий раз
+    if failed:
+        new_watermark = min(config['modifiedTime'] for config in failed)
+    else:
+        new_watermark = config_list[-1]['modifiedTime']
+    await db.set_sync_value(DRIVE_WATERMARK_KEY, new_watermark)
+
+
+async def download_configs():
+    # Запуски по расписанию не должны накладываться друг на друга
+    if _download_lock.locked():
+        logger.info('Загрузка конфигов уже выполняется, запуск пропущен')
+        return
+    async with _download_lock:
+        await _download_configs()
+
 
 def transform_google_drive_link(link: str) -> str:
     """Преобразует обычную ссылку Google Диска в прямую ссылку для скачивания."""
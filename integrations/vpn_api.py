@@ -1,115 +1,189 @@
+import asyncio
+import time
 from pathlib import Path
+from typing import Any
 
 import aiohttp
 
+from config import Config
+from utils import logger
+
+
+class WgEasyClient:
+    """
+    Клиент API wg-easy с общим пулом соединений.
+
+    Cookie сессии получается один раз и переиспользуется; повторный вход
+    выполняется только когда сервер ответил 401.
+
+    Соответствие имени клиента и его id хранится в локальном индексе, который
+    обновляется при создании/удалении клиентов. Полный список клиентов
+    загружается только при промахе по индексу или раз в index_ttl секунд.
+    """
+
+    # Не чаще этого интервала перезагружаем список при промахах по индексу, сек
+    MISS_REFRESH_INTERVAL = 5
+
+    def __init__(self, base_url: str, password: str, limit: int = 20, timeout: int = 15,
+                 index_ttl: int = 3600):
+        self.base_url = base_url.rstrip('/') if base_url else base_url
+        self.password = password
+        self.limit = limit
+        self.timeout = timeout
+        self.index_ttl = index_ttl
+        self._session: aiohttp.ClientSession | None = None
+        self._cookie: str | None = None
+        self._login_lock = asyncio.Lock()
+        self._index: dict[str, str] = {}
+        self._index_loaded_at: float | None = None
+        self._index_lock = asyncio.Lock()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия создаётся лениво, внутри работающего event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                # Cookie передаём вручную: стандартный cookie jar не сохраняет cookie для IP-адресов
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _login(self, stale_cookie: str | None):
+        async with self._login_lock:
+            # Пока ждали блокировку, другой запрос мог уже войти заново
+            if self._cookie is not None and self._cookie != stale_cookie:
+                return
+            async with self._get_session().post(
+                    f'{self.base_url}/api/session',
+                    json={'password': self.password},
+            ) as response:
+                response.raise_for_status()
+                self._cookie = response.headers.get('Set-Cookie').split(';')[0]
+                logger.info('Выполнен вход в wg-easy')
+
+    async def _request(self, method: str, path: str, raw: bool = False, **kwargs) -> Any:
+        for attempt in range(2):
+            if self._cookie is None:
+                await self._login(None)
+            cookie = self._cookie
+            async with self._get_session().request(
+                    method,
+                    f'{self.base_url}{path}',
+                    headers={'Cookie': cookie},
+                    **kwargs
+            ) as response:
+                if response.status == 401 and attempt == 0:
+                    await self._login(cookie)
+                    continue
+                response.raise_for_status()
+                if raw:
+                    return await response.read()
+                return await response.json(content_type=None)
+
+    async def get_clients(self) -> list[dict]:
+        return await self._request('GET', '/api/wireguard/client')
+
+    async def refresh_index(self, max_age: float = 0):
+        """Перезагружает индекс имя -> id, если он старше max_age секунд."""
+        async with self._index_lock:
+            # Пока ждали блокировку, индекс мог обновить другой запрос
+            if self._index_loaded_at is not None and time.monotonic() - self._index_loaded_at < max_age:
+                return
+            clients = await self.get_clients()
+            self._index = {c['name']: c['id'] for c in clients}
+            self._index_loaded_at = time.monotonic()
+            logger.info(f'Индекс клиентов wg-easy обновлён: {len(self._index)}')
+
+    async def get_client_id(self, name: str) -> str | None:
+        if self._index_loaded_at is None or time.monotonic() - self._index_loaded_at > self.index_ttl:
+            await self.refresh_index(self.index_ttl)
+        client_id = self._index.get(name)
+        if client_id is None:
+            await self.refresh_index(self.MISS_REFRESH_INTERVAL)
+            client_id = self._index.get(name)
+        return client_id
 
-BASE_URL = 'http://91.196.34.46:51821'
-
-
-async def __get_session():
-    url = 'http://91.196.34.46:51821/api/session'
-    payload = {
-        'password': 'hr67jwH6S365'
-    }
-    headers = {
-        "Content-Type": "application/json",
-    }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload, headers=headers) as response:
-            session_cookie = response.headers.get('Set-Cookie').split(';')[0]
-            return session_cookie
+    async def create_client(self, name: str):
+        client_id = await self.get_client_id(name)
+        if client_id:
+            return client_id
+        result = await self._request('POST', '/api/wireguard/client', json={'name': name})
+        if isinstance(result, dict) and result.get('id'):
+            self._index[name] = result['id']
+        else:
+            # Ответ без id (зависит от версии wg-easy) - подтянем его при следующем обращении
+            self._index_loaded_at = None
+        return result
+
+    async def delete_client(self, name: str):
+        cid = await self.get_client_id(name)
+        if cid is None:
+            return None
+        result = await self._request('DELETE', f'/api/wireguard/client/{cid}')
+        self._index.pop(name, None)
+        return result
+
+    async def _client_action(self, name: str, action: str):
+        cid = await self.get_client_id(name)
+        if cid is None:
+            raise LookupError(f'Клиент wg-easy {name} не найден')
+        try:
+            return await self._request('POST', f'/api/wireguard/client/{cid}/{action}')
+        except aiohttp.ClientResponseError as e:
+            if e.status != 404:
+                raise
+            # Клиент пересоздан в обход бота - индекс устарел, перезагружаем его без учёта возраста
+            await self.refresh_index(0)
+            cid = self._index.get(name)
+            if cid is None:
+                raise LookupError(f'Клиент wg-easy {name} не найден')
+            return await self._request('POST', f'/api/wireguard/client/{cid}/{action}')
+
+    async def enable(self, name: str):
+        return await self._client_action(name, 'enable')
+
+    async def disable(self, name: str):
+        return await self._client_action(name, 'disable')
+
+    async def download_config(self, name: str, cid: str) -> Path | None:
+        try:
+            config_data = await self._request('GET', f'/api/wireguard/client/{cid}/configuration', raw=True)
+        except aiohttp.ClientResponseError as e:
+            logger.error(f'❌ Ошибка скачивания конфига: {e.status}\n{e.message}')
+            return None
+        # Путь на директорию выше и в папку downloads/
+        downloads_dir = Path(__file__).resolve().parent.parent / "downloads"
+        downloads_dir.mkdir(parents=True, exist_ok=True)  # ← создаёт папку, если её нет
+        filename = downloads_dir / f"{name}.conf"
+        with open(filename, "wb") as f:
+            f.write(config_data)
+        logger.info(f"✅ Конфиг сохранён в файл {filename}")
+        return filename
+
+
+wg_client = WgEasyClient(Config.WG_EASY_URL, Config.WG_EASY_PASSWORD, index_ttl=Config.WG_EASY_INDEX_TTL)
 
 
 async def create_vpn_user(user_id: int):
-    client_id = await get_client_id(str(user_id))
-    if client_id:
-        return client_id
-    else:
-        s_id = await __get_session()
-        url = f"{BASE_URL}/api/wireguard/client"
-        payload = {"name": f"{user_id}"}
-        headers = {
-            "Content-Type": "application/json",
-            "Cookie": f'{s_id}'
-        }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                # print(response)
-                result = await response.json()
-                return result
-
-
-async def __get_clients():
-    url = f"{BASE_URL}/api/wireguard/client"
-    async with aiohttp.ClientSession() as session:
-        s_id = await __get_session()
-        headers = {
-            "Content-Type": "application/json",
-            "Cookie": f'{s_id}'
-        }
-        async with session.get(url, headers=headers) as resp:
-            result = await resp.json()
-            return result
+    return await wg_client.create_client(str(user_id))
 
 
 async def get_client_id(name: str):
-    clients = await __get_clients()
-    client_id = None
-    for c in clients:
-        if c['name'] == name:
-            client_id = c['id']
-            break
-    return client_id
+    return await wg_client.get_client_id(name)
 
 
 async def download_config(name, cid: str):
-    url = f"{BASE_URL}/api/wireguard/client/{cid}/configuration"
-    async with aiohttp.ClientSession() as session:
-        s_id = await __get_session()
-        headers = {
-            "Content-Type": "application/json",
-            "Cookie": f'{s_id}'
-        }
-        async with session.get(url, headers=headers) as resp:
-            if resp.status == 200:
-                config_data = await resp.read()
-                # Путь на директорию выше и в папку downloads/
-                downloads_dir = Path(__file__).resolve().parent.parent / "downloads"
-                downloads_dir.mkdir(parents=True, exist_ok=True)  # ← создаёт папку, если её нет
-                filename = downloads_dir / f"{name}.conf"
-                with open(filename, "wb") as f:
-                    f.write(config_data)
-                print(f"✅ Конфиг сохранён в файл {filename}")
-                return filename
-            else:
-                text = await resp.text()
-                print(f"❌ Ошибка скачивания конфига: {resp.status}\n{text}")
+    return await wg_client.download_config(name, cid)
 
 
 async def disable(uid: int):
-    sid = await __get_session()
-    cid = await get_client_id(str(uid))
-    url = f"{BASE_URL}/api/wireguard/client/{cid}/disable"
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "Content-Type": "application/json",
-            "Cookie": f'{sid}'
-        }
-        async with session.post(url, headers=headers) as response:
-            result = await response.json()
-            return result
+    return await wg_client.disable(str(uid))
 
 
 async def enable(uid: int):
-    sid = await __get_session()
-    cid = await get_client_id(str(uid))
-    url = f"{BASE_URL}/api/wireguard/client/{cid}/enable"
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "Content-Type": "application/json",
-            "Cookie": f'{sid}'
-        }
-        async with session.post(url, headers=headers) as response:
-            result = await response.json()
-            return result
+    return await wg_client.enable(str(uid))
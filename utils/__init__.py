@@ -1 +1,2 @@
-from utils.utils import msg_ids, logger, auto_state_clear, captions
\ No newline at end of file
+from utils.utils import logger, auto_state_clear, captions, state_expiry
+from utils.rate_limit import TokenBucket
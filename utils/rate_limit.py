@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Асинхронный ограничитель частоты запросов (token bucket).
+
+    Скорость пополнения можно снижать при ответах "слишком много запросов" (back_off)
+    и постепенно возвращать к исходной после успешных запросов (recover).
+    """
+
+    def __init__(self, rate: float, capacity: int | None = None, min_rate: float = 0.5):
+        """
+        :param rate: Максимальное количество запросов в секунду.
+        :param capacity: Размер "всплеска" запросов (по умолчанию равен rate).
+        :param min_rate: Нижняя граница скорости при снижении.
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def back_off(self, factor: float = 0.5):
+        """Уменьшает скорость (мультипликативно) и сбрасывает накопленные токены."""
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * factor)
+        self._tokens = 0
+
+    def recover(self, step: float = 0.05):
+        """Плавно (аддитивно) возвращает скорость к максимальной."""
+        self.rate = min(self.max_rate, self.rate + self.max_rate * step)
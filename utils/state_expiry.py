@@ -0,0 +1,108 @@
+import asyncio
+import heapq
+import time
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+from logger.file_logger import CustomLogger
+
+
+class StateExpiry:
+    """
+    Сброс состояния FSM у пользователей, неактивных дольше таймаута.
+
+    Вместо отдельной задачи на каждого пользователя хранится время последней
+    активности и куча дедлайнов, которую раз в interval секунд разбирает одна
+    фоновая задача. Устаревшие записи кучи (после повторной активности) просто
+    пропускаются, поэтому touch стоит O(log n), а проход - O(истёкших).
+
+    Если состояния общие для нескольких процессов (см. share), куча одного
+    процесса не знает об активности в других, поэтому состояния сбрасываются
+    в БД: раз в shared_interval секунд у ключей с активностью в этом процессе
+    переносится fsm_states.updated_at, а записи старше таймаута удаляются.
+    """
+
+    def __init__(self, logger: CustomLogger, interval: float = 1, batch_size: int = 100):
+        self.logger = logger
+        self.interval = interval
+        self.batch_size = batch_size
+        self._deadlines: dict[int, tuple[float, FSMContext]] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._task: asyncio.Task | None = None
+        self._storage = None
+        self._touched: set[StorageKey] = set()
+        self._timeout = 0.0
+
+    def share(self, storage, interval: float = 30):
+        """Сбрасывать состояния в общем хранилище (SqliteStorage с shared=True) вместо кучи процесса."""
+        self._storage = storage
+        self.interval = interval
+
+    def touch(self, user_id: int, state: FSMContext, timeout: float):
+        """Отмечает активность пользователя: состояние сбросится через timeout секунд."""
+        if self._storage is not None:
+            self._touched.add(state.key)
+            self._timeout = max(self._timeout, timeout)
+            self.start()
+            return
+        deadline = time.monotonic() + timeout
+        self._deadlines[user_id] = (deadline, state)
+        heapq.heappush(self._heap, (deadline, user_id))
+        # Пересобираем кучу, если в ней накопилось много устаревших записей
+        if len(self._heap) > 2 * len(self._deadlines) + 1000:
+            self._heap = [(deadline, uid) for uid, (deadline, _) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        self.start()
+
+    def _pop_expired(self, now: float) -> list[tuple[int, FSMContext]]:
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, user_id = heapq.heappop(self._heap)
+            current = self._deadlines.get(user_id)
+            if current is None or current[0] != deadline:
+                continue  # Пользователь был активен позже
+            del self._deadlines[user_id]
+            expired.append((user_id, current[1]))
+        return expired
+
+    async def _clear(self, user_id: int, state: FSMContext):
+        try:
+            await state.clear()
+        except Exception as e:
+            self.logger.error(f'Ошибка при сбросе состояния для {user_id}: {e}')
+
+    async def sweep(self):
+        """Сбрасывает состояния всех пользователей с наступившим дедлайном."""
+        if self._storage is not None:
+            touched, self._touched = list(self._touched), set()
+            await self._storage.touch(touched)
+            deleted = await self._storage.cleanup(self._timeout)
+            if deleted:
+                self.logger.info(f'Сброшено неактивных состояний: {deleted}')
+            return
+        expired = self._pop_expired(time.monotonic())
+        for i in range(0, len(expired), self.batch_size):
+            batch = expired[i:i + self.batch_size]
+            await asyncio.gather(*(self._clear(user_id, state) for user_id, state in batch))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                self.logger.error(f'Ошибка при сбросе состояний: {e}')
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None